@@ -0,0 +1,36 @@
+import copy
+import sys
+
+import torch
+
+from benchmark_utils import random_model, time_model
+
+print("-------------------------------------")
+print("🐳 float32 vs bfloat16 on the CPU 🐳")
+print("-------------------------------------")
+
+# number of timed runs, and the models to time; random weights of the real shapes
+n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+models = sys.argv[2].split(",") if len(sys.argv) > 2 else ["tiny", "base", "small"]
+
+
+torch.manual_seed(0)
+for name in models:
+    model = random_model(name)
+    mel = torch.randn(1, 80, 3000)
+
+    features, encoder_time, decoder_time = time_model(model, mel, n_runs)
+    print(
+        f"{name:>6}  float32: encoder {encoder_time * 1000:.0f}ms, decoder step {decoder_time * 1000:.1f}ms"
+    )
+
+    bf16_model = copy.deepcopy(model).to_bf16()
+    bf16_features, encoder_time, decoder_time = time_model(
+        bf16_model, mel.bfloat16(), n_runs
+    )
+    print(
+        f"{name:>6} bfloat16: encoder {encoder_time * 1000:.0f}ms, decoder step {decoder_time * 1000:.1f}ms"
+    )
+
+    diff = (bf16_features.float() - features).abs().max().item()
+    print(f"{name:>6} max abs diff of the audio features: {diff:.2e}")
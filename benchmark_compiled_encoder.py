@@ -0,0 +1,50 @@
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import torch
+
+from benchmark_utils import model_dims, random_model
+from whisper.model import Whisper
+
+print("-----------------------------------------")
+print("🐳 eager vs compiled encoder on the CPU 🐳")
+print("-----------------------------------------")
+
+# number of timed runs, and the models to time; random weights of the real shapes
+n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+models = sys.argv[2].split(",") if len(sys.argv) > 2 else ["tiny", "base", "small"]
+
+
+def time_encoder(model: Whisper, mel: torch.Tensor):
+    with torch.no_grad():
+        model.encoder(mel)  # warm up
+        startT = timer()
+        for _ in range(n_runs):
+            model.encoder(mel)
+    return (timer() - startT) / n_runs
+
+
+torch.manual_seed(0)
+mel = torch.randn(1, 80, 3000)
+with tempfile.TemporaryDirectory() as cache_dir:
+    for name in models:
+        model = random_model(name)
+        eager_time = time_encoder(model, mel)
+
+        startT = timer()
+        model.compile_encoder(cache_dir)
+        compile_time = timer() - startT
+
+        # a restarted worker finds the graph on disk
+        restarted = Whisper(model_dims(name), use_coreml=False, modelName=name).eval()
+        restarted.load_state_dict(model.state_dict())
+        startT = timer()
+        restarted.compile_encoder(cache_dir)
+        load_time = timer() - startT
+
+        compiled_time = time_encoder(restarted, mel)
+        print(
+            f"{name:>6}: eager {eager_time * 1000:.0f}ms, compiled {compiled_time * 1000:.0f}ms "
+            f"per window; compiling {compile_time:.1f}s, loading from the cache {load_time:.1f}s"
+        )
@@ -0,0 +1,60 @@
+import copy
+import sys
+from timeit import default_timer as timer
+
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+
+from benchmark_utils import random_model
+
+print("-------------------------------------------------------")
+print("🐳 encoder allocations: runtime vs conversion blocks 🐳")
+print("-------------------------------------------------------")
+
+# the models to measure; random weights of the real shapes
+models = sys.argv[1].split(",") if len(sys.argv) > 1 else ["tiny", "base", "small"]
+
+
+class CountAllocations(TorchDispatchMode):
+    """Counts the tensors that ops allocate for their outputs; views share their input memory"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.size = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        outputs = func(*args, **(kwargs or {}))
+        returns = func._schema.returns
+        for ret, output in zip(returns, outputs if len(returns) > 1 else [outputs]):
+            if isinstance(output, torch.Tensor) and ret.alias_info is None:
+                self.count += 1
+                self.size += output.nbytes
+        return outputs
+
+
+def measure(encoder, mel: torch.Tensor):
+    with torch.no_grad():
+        encoder(mel)  # warm up
+        startT = timer()
+        encoder(mel)
+        duration = timer() - startT
+
+        with CountAllocations() as allocations:
+            encoder(mel)
+    return allocations.count, allocations.size, duration
+
+
+torch.manual_seed(0)
+for name in models:
+    encoder = random_model(name).encoder
+    mel = torch.randn(1, 80, 3000)
+
+    for variant, model in [
+        ("runtime", encoder),
+        ("conversion", copy.deepcopy(encoder).for_conversion()),
+    ]:
+        count, size, duration = measure(model, mel)
+        print(
+            f"{name:>6} {variant:>10}: {count} allocations, {size / 2**20:.0f}MiB allocated, {duration * 1000:.0f}ms"
+        )
@@ -0,0 +1,36 @@
+import sys
+from timeit import default_timer as timer
+
+import torch
+
+from benchmark_utils import MODEL_DIMS
+from whisper.encoder import MultiHeadAttention, ResidualAttentionBlock
+
+print("--------------------------------------------")
+print("🐳 encoder block: per-head loop vs batched 🐳")
+print("--------------------------------------------")
+
+# number of timed runs per block, and the models to time the blocks of
+n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+models = sys.argv[2].split(",") if len(sys.argv) > 2 else ["tiny", "base", "small"]
+
+torch.manual_seed(0)
+for name in models:
+    n_state, n_head, _ = MODEL_DIMS[name]
+    block = ResidualAttentionBlock(n_state, n_head).eval()
+    x = torch.randn(1, 1500, n_state)
+
+    outputs = {}
+    for use_sdpa in [False, True]:
+        MultiHeadAttention.use_sdpa = use_sdpa
+        with torch.no_grad():
+            outputs[use_sdpa] = block(x)  # warm up
+            startT = timer()
+            for _ in range(n_runs):
+                block(x)
+            duration = (timer() - startT) / n_runs
+        mode = "batched" if use_sdpa else "loop"
+        print(f"{name:>6} {mode:>8}: {duration * 1000:.1f}ms per block")
+
+    diff = (outputs[True] - outputs[False]).abs().max().item()
+    print(f"{name:>6} max abs diff: {diff:.2e}")
@@ -0,0 +1,55 @@
+import multiprocessing
+import resource
+import sys
+from timeit import default_timer as timer
+
+import torch
+
+from benchmark_utils import MODEL_DIMS
+from whisper.encoder import AudioEncoder
+
+# windows per forward pass, and the models to measure; random weights of the real shapes
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+models = sys.argv[2].split(",") if len(sys.argv) > 2 else ["tiny", "base", "small"]
+
+
+def max_rss_mib():
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def measure(name: str, low_memory: bool, results):
+    n_state, n_head, n_layer = MODEL_DIMS[name]
+    with torch.no_grad():
+        encoder = AudioEncoder(80, 1500, n_state, n_head, n_layer, False, name).eval()
+        if low_memory:
+            encoder.limit_memory()
+        mel = torch.randn(batch_size, 80, 3000)
+        loaded = max_rss_mib()
+
+        startT = timer()
+        encoder(mel)
+        duration = timer() - startT
+    results.put((loaded, max_rss_mib(), duration))
+
+
+if __name__ == "__main__":
+    print("-------------------------------------------------")
+    print("🐳 encoder peak memory: default vs low-memory 🐳")
+    print("-------------------------------------------------")
+
+    # a fresh process per measurement, since the peak RSS of a process never goes down
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    for name in models:
+        for low_memory in [False, True]:
+            process = context.Process(target=measure, args=(name, low_memory, results))
+            process.start()
+            loaded, peak, duration = results.get()
+            process.join()
+
+            mode = "low-memory" if low_memory else "default"
+            print(
+                f"{name:>6} {mode:>10}: peak RSS {peak:.0f}MiB, {peak - loaded:.0f}MiB above the weights, {duration * 1000:.0f}ms"
+            )
@@ -0,0 +1,38 @@
+import copy
+import sys
+
+import torch
+
+from benchmark_utils import random_model, time_model
+
+print("-----------------------------------------")
+print("🐳 separate vs fused QKV on the CPU 🐳")
+print("-----------------------------------------")
+
+# number of timed runs, and the models to time; random weights of the real shapes
+n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+models = sys.argv[2].split(",") if len(sys.argv) > 2 else ["tiny", "base", "small"]
+
+
+torch.manual_seed(0)
+for name in models:
+    model = random_model(name)
+    for module in model.modules():
+        if isinstance(module, torch.nn.LayerNorm):
+            torch.nn.init.normal_(module.weight, 1.0, 0.2)
+            torch.nn.init.normal_(module.bias, 0.0, 0.2)
+    mel = torch.randn(1, 80, 3000)
+
+    features, encoder_time, decoder_time = time_model(model, mel, n_runs)
+    print(
+        f"{name:>6} separate: encoder {encoder_time * 1000:.0f}ms, decoder step {decoder_time * 1000:.1f}ms"
+    )
+
+    fused_model = copy.deepcopy(model).fuse_qkv()
+    fused_features, encoder_time, decoder_time = time_model(fused_model, mel, n_runs)
+    print(
+        f"{name:>6}    fused: encoder {encoder_time * 1000:.0f}ms, decoder step {decoder_time * 1000:.1f}ms"
+    )
+
+    diff = (fused_features - features).abs().max().item()
+    print(f"{name:>6} max abs diff of the audio features: {diff:.2e}")
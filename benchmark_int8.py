@@ -0,0 +1,41 @@
+import sys
+from timeit import default_timer as timer
+
+import whisper
+from benchmark_utils import word_error_rate
+from whisper.audio import SAMPLE_RATE, load_audio
+from whisper.normalizers import EnglishTextNormalizer
+
+print("------------------------------------")
+print("🐳 int8 weights: accuracy and speed 🐳")
+print("------------------------------------")
+
+# model name, and comma-separated audio files
+model_name = sys.argv[1] if len(sys.argv) > 1 else "tiny"
+files = sys.argv[2].split(",") if len(sys.argv) > 2 else ["tests/jfk.flac"]
+
+
+normalizer = EnglishTextNormalizer()
+audios = [load_audio(file) for file in files]
+total_duration = sum(len(audio) for audio in audios) / SAMPLE_RATE
+
+references = None
+for int8 in [False, True]:
+    model = whisper.load_model(model_name, device="cpu", use_coreml=False, int8=int8)
+    texts = []
+    startT = timer()
+    for audio in audios:
+        result = whisper.transcribe(
+            model, audio, language="en", fp16=False, temperature=0.0
+        )
+        texts.append(normalizer(result["text"]))
+    duration = timer() - startT
+
+    if references is None:
+        # the float32 model is the reference the int8 one is compared against
+        references = texts
+    wer = sum(word_error_rate(r, t) for r, t in zip(references, texts)) / len(texts)
+    mode = "int8" if int8 else "float32"
+    print(
+        f"{mode:>8}: {duration:.2f}s, RTF {duration / total_duration:.3f}, WER vs float32 {wer:.1%}"
+    )
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import wave
+from subprocess import run
+from timeit import default_timer as timer
+
+import numpy as np
+
+from whisper.audio import SAMPLE_RATE, load_audio
+
+print("------------------------------")
+print("🐳 load_audio per-file cost 🐳")
+print("------------------------------")
+
+# number of clips and their length in seconds
+n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+
+
+def ffmpeg_load_audio(file: str):
+    # the previous load_audio(), which always forks ffmpeg
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", file,
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "-"
+    ]
+    # fmt: on
+    out = run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+audio = load_audio(os.path.join(os.path.dirname(__file__), "tests", "jfk.flac"))
+audio = np.resize(audio, int(duration * SAMPLE_RATE))
+pcm = (audio * 32768).astype("<i2")
+
+with tempfile.TemporaryDirectory() as folder_path:
+    files = []
+    for i in range(n_files):
+        files.append(os.path.join(folder_path, f"{i}.wav"))
+        with wave.open(files[-1], "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm.tobytes())
+
+    for name, load in [("ffmpeg", ffmpeg_load_audio), ("in-process", load_audio)]:
+        startT = timer()
+        for file in files:
+            loaded = load(file)
+        duration_per_file = (timer() - startT) / n_files
+        assert np.array_equal(loaded, load_audio(files[0]))
+        print(f"{name:>10}: {duration_per_file * 1000:.3f}ms per {duration:.1f}s file")
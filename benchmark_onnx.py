@@ -0,0 +1,58 @@
+import sys
+from timeit import default_timer as timer
+
+import torch
+
+import whisper
+from whisper.decoding import PyTorchInference
+
+print("------------------------------------")
+print("🐳 PyTorch vs ONNX Runtime on CPU 🐳")
+print("------------------------------------")
+
+# model exported by `python convert_onnx.py <model>`, number of timed runs, and an audio file
+model_name = sys.argv[1] if len(sys.argv) > 1 else "tiny"
+n_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+audio_path = sys.argv[3] if len(sys.argv) > 3 else "tests/jfk.flac"
+n_steps = 30
+
+torch.manual_seed(0)
+mel = torch.randn(1, 80, 3000)
+outputs = {}
+for backend in ["pytorch", "onnx"]:
+    model = whisper.load_model(model_name, device="cpu", backend=backend)
+
+    with torch.no_grad():
+        features = model.encoder(mel)  # warm up, and loads the ONNX sessions
+        startT = timer()
+        for _ in range(n_runs):
+            features = model.encoder(mel)
+        encoder_time = (timer() - startT) / n_runs
+
+        # greedy decoding steps with the KV caches, as in DecodingTask._main_loop()
+        inference = PyTorchInference(model, 3)
+        model.text_offset = 0
+        tokens = torch.tensor([[50258, 50259, 50359]])
+        logits, _ = inference.logits(tokens, features)
+        startT = timer()
+        for _ in range(n_steps):
+            tokens = torch.cat([tokens, logits[:, -1:].argmax(dim=-1)], dim=1)
+            logits, _ = inference.logits(tokens, features)
+        decoder_time = (timer() - startT) / n_steps
+        inference.cleanup_caching()
+    outputs[backend] = features
+
+    startT = timer()
+    result = whisper.transcribe(
+        model, audio_path, language="en", fp16=False, temperature=0.0
+    )
+    transcribe_time = timer() - startT
+
+    print(
+        f"{backend:>8}: encoder {encoder_time * 1000:.0f}ms, decoder step {decoder_time * 1000:.1f}ms, "
+        f"transcribe() {transcribe_time:.2f}s"
+    )
+    print(f"{backend:>8}: {result['text']}")
+
+diff = (outputs["onnx"] - outputs["pytorch"]).abs().max().item()
+print(f"max abs diff of the audio features: {diff:.2e}")
@@ -0,0 +1,41 @@
+import sys
+from timeit import default_timer as timer
+
+import torch
+
+from benchmark_utils import random_model
+from whisper.pipeline import PipelineEncoder
+
+# number of windows encoded, and the models to time; random weights of the real shapes
+n_windows = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+models = sys.argv[2].split(",") if len(sys.argv) > 2 else ["medium", "large"]
+
+
+if __name__ == "__main__":
+    print("--------------------------------------------")
+    print("🐳 encoder: one process vs stage pipeline 🐳")
+    print("--------------------------------------------")
+    print(f"{torch.get_num_threads()} threads, {n_windows} windows")
+
+    torch.manual_seed(0)
+    for name in models:
+        model = random_model(name)
+        mels = torch.randn(n_windows, 80, 3000)
+
+        model.encode_windows(mels[:1])  # warm up
+        startT = timer()
+        expected = model.encode_windows(mels, batch_size=1)
+        duration = timer() - startT
+        print(f"{name:>6}  single: {n_windows / duration:.2f} windows/s")
+
+        with PipelineEncoder(model.encoder) as pipeline:
+            pipeline.encode_windows(mels[: len(pipeline.workers)])  # warm up
+            startT = timer()
+            features = pipeline.encode_windows(mels)
+            duration = timer() - startT
+        print(
+            f"{name:>6} pipeline: {n_windows / duration:.2f} windows/s over {len(pipeline.workers)} stages"
+        )
+
+        diff = (features - expected).abs().max().item()
+        print(f"{name:>6} max abs diff of the audio features: {diff:.2e}")
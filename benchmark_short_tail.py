@@ -0,0 +1,49 @@
+import sys
+from timeit import default_timer as timer
+
+import whisper
+from benchmark_utils import word_error_rate
+from whisper.audio import SAMPLE_RATE, load_audio
+from whisper.normalizers import EnglishTextNormalizer
+
+print("----------------------------------------")
+print("🐳 short tail: accuracy and speed 🐳")
+print("----------------------------------------")
+
+# model name, comma-separated short clips, and comma-separated bucket sizes in frames
+model_name = sys.argv[1] if len(sys.argv) > 1 else "tiny"
+files = sys.argv[2].split(",") if len(sys.argv) > 2 else ["tests/jfk.flac"]
+buckets = (
+    [int(b) for b in sys.argv[3].split(",")] if len(sys.argv) > 3 else [250, 500, 1000]
+)
+
+
+model = whisper.load_model(model_name, use_coreml=False)
+normalizer = EnglishTextNormalizer()
+audios = [load_audio(file) for file in files]
+total_duration = sum(len(audio) for audio in audios) / SAMPLE_RATE
+
+references = None
+for short_tail_frames in [None] + buckets:
+    texts = []
+    startT = timer()
+    for audio in audios:
+        result = whisper.transcribe(
+            model,
+            audio,
+            language="en",
+            fp16=False,
+            temperature=0.0,
+            short_tail_frames=short_tail_frames,
+        )
+        texts.append(normalizer(result["text"]))
+    duration = timer() - startT
+
+    if references is None:
+        # the full 30-second context is the reference the short tail is compared against
+        references = texts
+    wer = sum(word_error_rate(r, t) for r, t in zip(references, texts)) / len(texts)
+    mode = "full" if short_tail_frames is None else f"{short_tail_frames} frames"
+    print(
+        f"{mode:>12}: {duration:.2f}s, RTF {duration / total_duration:.3f}, WER vs full {wer:.1%}"
+    )
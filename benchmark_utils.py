@@ -0,0 +1,68 @@
+from timeit import default_timer as timer
+
+import torch
+
+from whisper.decoding import PyTorchInference
+from whisper.model import ModelDimensions, Whisper
+
+# (n_state, n_head, n_layer) of the encoder and decoder of each model size
+MODEL_DIMS = {
+    "tiny": (384, 6, 4),
+    "base": (512, 8, 6),
+    "small": (768, 12, 12),
+    "medium": (1024, 16, 24),
+    "large": (1280, 20, 32),
+}
+
+
+def model_dims(name: str) -> ModelDimensions:
+    n_state, n_head, n_layer = MODEL_DIMS[name]
+    return ModelDimensions(
+        80, 1500, n_state, n_head, n_layer, 51865, 448, n_state, n_head, n_layer
+    )
+
+
+def random_model(name: str) -> Whisper:
+    """A model of the real shapes with random weights, the embeddings at a trained scale"""
+    model = Whisper(model_dims(name), use_coreml=False, modelName=name).eval()
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.01)
+    torch.nn.init.normal_(model.decoder.token_embedding.weight, std=0.02)
+    return model
+
+
+def time_model(model: Whisper, mel: torch.Tensor, n_runs: int, n_steps: int = 30):
+    """
+    Time the encoder on `mel`, averaged over `n_runs`, and `n_steps` greedy decoding steps with
+    the KV caches, as in DecodingTask._main_loop(); returns the features and both times
+    """
+    with torch.no_grad():
+        features = model.encoder(mel)  # warm up
+        startT = timer()
+        for _ in range(n_runs):
+            features = model.encoder(mel)
+        encoder_time = (timer() - startT) / n_runs
+
+        inference = PyTorchInference(model, 3)
+        model.text_offset = 0
+        tokens = torch.tensor([[50258, 50259, 50359]])
+        logits, _ = inference.logits(tokens, features)
+        startT = timer()
+        for _ in range(n_steps):
+            tokens = torch.cat([tokens, logits[:, -1:].argmax(dim=-1)], dim=1)
+            logits, _ = inference.logits(tokens, features)
+        decoder_time = (timer() - startT) / n_steps
+    return features, encoder_time, decoder_time
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    ref, hyp = reference.split(), hypothesis.split()
+    distances = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, distances[j] = distances[j], min(
+                distances[j] + 1,
+                distances[j - 1] + 1,
+                previous + (ref_word != hyp_word),
+            )
+    return distances[-1] / max(1, len(ref))
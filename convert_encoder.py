@@ -17,7 +17,8 @@ modelSize = modelName.split(".")[0]
 n_state = { 'tiny': 384, 'base': 512, 'small': 768, 'medium': 1024, 'large': 1280}[modelSize]
 n_layer = { 'tiny': 4, 'base': 6, 'small': 12, 'medium': 24, 'large': 32}[modelSize]
 
-encoder = model.encoder
+# the coremltools workarounds are only in the conversion variant of the blocks
+encoder = model.encoder.for_conversion()
 encoder.eval()
 
 total_conversion_time = 0
@@ -0,0 +1,140 @@
+import whisper
+import torch
+import inspect
+import os
+import sys
+import warnings
+from timeit import default_timer as timer
+
+print("----------")
+print("🐳 ONNX 🐳")
+print("----------")
+
+# model setting
+modelName = sys.argv[1] if len(sys.argv) > 1 else "small"
+model = whisper.load_model(modelName, device="cpu")
+dims = model.dims
+n_state = dims.n_text_state
+n_layer = dims.n_text_layer
+n_head = n_state//64
+
+encoder = model.encoder
+encoder.eval()
+decoder = model.decoder
+decoder.eval()
+# read while tracing to pick the alignment heads; sparse unless set by set_alignment_heads()
+if decoder.alignment_heads.is_sparse:
+    decoder.alignment_heads = decoder.alignment_heads.to_dense()
+
+folder_path = f"onnx/{modelName}"
+os.makedirs(folder_path, exist_ok=True)
+
+# torch.onnx.export traces forward(); these call the same pieces as the CoreML conversion scripts
+class Block12(torch.nn.Module):
+    def __init__(self, from_block_idx: int):
+        super().__init__()
+        self.encoder = encoder
+        self.from_block_idx = from_block_idx
+
+    def forward(self, x):
+        self.encoder.from_block_idx = self.from_block_idx
+        return self.encoder.block12(x)
+
+class CrossKV(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, xa):
+        return self.decoder.crossKVCaches(xa)
+
+class ForwardBlocks(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, x, qk_mask, masked_kv_caches, cross_k_caches, cross_v_caches):
+        return self.decoder.forwardBlocks(x, qk_mask, masked_kv_caches, cross_k_caches, cross_v_caches)
+
+# the TorchScript exporter; torch >= 2.5 has a `dynamo` option, which newer versions default to
+export_options = {}
+if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+    export_options["dynamo"] = False
+
+def export(module, name, inputs, input_names, output_names, dynamic_axes):
+    startT = timer()
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.filterwarnings(action='ignore', category=torch.jit.TracerWarning)
+        torch.onnx.export(module,
+                          inputs,
+                          f"{folder_path}/{name}.onnx",
+                          input_names=input_names,
+                          output_names=output_names,
+                          dynamic_axes=dynamic_axes,
+                          opset_version=17,
+                          **export_options)
+    print(f"{modelName} {name} export time: {timer()-startT:.3f}s")
+
+# the frames of the audio features vary with short_tail_frames; the encoder is only exported
+# for whole 30-second windows
+n_frames = {"xa": {1: "n_frames"},
+            "cross_k_caches": {3: "n_frames"},
+            "cross_v_caches": {2: "n_frames"},
+            "out_cross_k_caches": {3: "n_frames"},
+            "out_cross_v_caches": {2: "n_frames"},
+            "out_cross_head_weights": {2: "n_frames"}}
+
+#
+# Encoder: the PyTorch code path, without the coremltools workarounds
+#
+for block_idx in range(0, dims.n_audio_layer, 12):
+    if block_idx == 0:
+        x = torch.ones((1, dims.n_mels, dims.n_audio_ctx * 2))
+    else:
+        x = torch.ones((1, dims.n_audio_ctx, dims.n_audio_state))
+    export(Block12(block_idx), f"Encoder{block_idx}", (x,), ["x"], ["out_x"], None)
+
+#
+# CrossKV
+#
+xa = torch.ones((1, dims.n_audio_ctx, n_state))
+export(CrossKV(), "CrossKV", (xa,), ["xa"],
+       ["out_cross_k_caches", "out_cross_v_caches"],
+       {k: v for k, v in n_frames.items() if k in ["xa", "out_cross_k_caches", "out_cross_v_caches"]})
+
+cross_k_caches = torch.ones((n_layer, n_head, 64, dims.n_audio_ctx))
+cross_v_caches = torch.ones((n_layer, n_head, dims.n_audio_ctx, 64))
+
+#
+# Decoder256: the first pass over the prompt, one beam at a time
+#
+max_n_ctx = decoder.max_n_ctx_for_1st
+x = torch.ones((1, max_n_ctx, n_state))
+qk_mask = torch.zeros((max_n_ctx, max_n_ctx))
+export(ForwardBlocks(), "Decoder256",
+       (x, qk_mask, None, cross_k_caches, cross_v_caches),
+       ["x", "qk_mask", "cross_k_caches", "cross_v_caches"],
+       ["out_x", "out_cross_head_weights", "out_new_masked_kv_caches"],
+       {k: v for k, v in n_frames.items() if k in ["cross_k_caches", "cross_v_caches", "out_cross_head_weights"]})
+
+#
+# Decoder1: one token for every beam; traced with 2 beams so that any beam size > 1 works, while
+# the steps of a single beam run in PyTorch, which is faster there
+#
+bs = 2
+x = torch.ones((bs, 1, n_state))
+qk_mask = torch.zeros((1, 449))
+masked_kv_caches = torch.ones((n_layer * 2, bs, 448, n_state))
+export(ForwardBlocks(), "Decoder",
+       (x, qk_mask, masked_kv_caches, cross_k_caches, cross_v_caches),
+       ["x", "qk_mask", "masked_kv_caches", "cross_k_caches", "cross_v_caches"],
+       ["out_x", "out_new_masked_kv_caches"],
+       {"x": {0: "bs"},
+        "masked_kv_caches": {1: "bs"},
+        "out_x": {0: "bs"},
+        "out_new_masked_kv_caches": {1: "bs"},
+        "cross_k_caches": {3: "n_frames"},
+        "cross_v_caches": {2: "n_frames"}})
+
+print("---------------------")
+print(f"python -m whisper YOUR_WAV_FILE --model={modelName} --backend=onnx")
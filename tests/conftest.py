@@ -12,3 +12,35 @@ def pytest_configure(config):
 def random():
     rand.seed(42)
     numpy.random.seed(42)
+
+
+@pytest.fixture
+def random_model():
+    """
+    Builds a small Whisper model with random weights, the same for every call; the width, heads
+    and layers can be chosen to reach code paths that depend on them
+    """
+    import torch
+
+    from whisper.model import ModelDimensions, Whisper
+
+    def build(n_state=128, n_head=2, n_audio_layer=1, n_text_layer=2):
+        torch.manual_seed(0)
+        dims = ModelDimensions(
+            80,
+            1500,
+            n_state,
+            n_head,
+            n_audio_layer,
+            51865,
+            448,
+            n_state,
+            n_head,
+            n_text_layer,
+        )
+        model = Whisper(dims, use_coreml=False, modelName="test").eval()
+        # left uninitialized by Whisper, which expects it from the checkpoint
+        torch.nn.init.normal_(model.decoder.positional_embedding)
+        return model
+
+    return build
@@ -1,8 +1,25 @@
+import io
 import os.path
+import wave
 
 import numpy as np
+import pytest
+import scipy.signal
+import torch
 
-from whisper.audio import SAMPLE_RATE, load_audio, log_mel_spectrogram
+from whisper.audio import (
+    N_SAMPLES,
+    SAMPLE_RATE,
+    CompactMel,
+    LogMelWindows,
+    MelCache,
+    _decode_in_process,
+    load_audio,
+    load_audio_chunks,
+    log_mel_spectrogram,
+    log_mel_spectrogram_batch,
+    resample,
+)
 
 
 def test_audio():
@@ -17,3 +34,179 @@ def test_audio():
 
     assert np.allclose(mel_from_audio, mel_from_file)
     assert mel_from_audio.max() - mel_from_audio.min() <= 2.0
+
+
+def test_load_audio_chunks():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    chunk_size = SAMPLE_RATE * 4
+    chunks = list(load_audio_chunks(audio_path, chunk_size=chunk_size))
+
+    assert len(chunks) == 3
+    assert all(chunk.shape[0] == chunk_size for chunk in chunks[:-1])
+    assert 0 < chunks[-1].shape[0] <= chunk_size
+    assert np.array_equal(np.concatenate(chunks), load_audio(audio_path))
+
+
+class _Stream(io.RawIOBase):
+    """a non-seekable binary stream, like a socket or a request body"""
+
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.data.readinto(buffer)
+
+
+def test_load_audio_from_bytes():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    expected = load_audio(audio_path)
+    with open(audio_path, "rb") as f:
+        data = f.read()
+
+    assert np.array_equal(load_audio(data), expected)
+    assert np.array_equal(load_audio(io.BytesIO(data)), expected)
+    assert np.array_equal(load_audio(io.BufferedReader(_Stream(data))), expected)
+
+    chunks = load_audio_chunks(_Stream(data), chunk_size=SAMPLE_RATE * 4)
+    assert np.array_equal(np.concatenate(list(chunks)), expected)
+
+    with pytest.raises(RuntimeError):
+        load_audio(b"not an audio file")
+
+
+class _FailingStream(_Stream):
+    """a stream that breaks down after `n_bytes`, like a dropped connection"""
+
+    def __init__(self, data: bytes, n_bytes: int):
+        super().__init__(data[:n_bytes])
+
+    def readinto(self, buffer):
+        if n := super().readinto(buffer):
+            return n
+        raise ConnectionResetError("the stream was cut off")
+
+
+def test_load_audio_from_failing_stream():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    with open(audio_path, "rb") as f:
+        data = f.read()
+
+    # the error of the thread feeding ffmpeg is raised rather than leaving ffmpeg waiting
+    with pytest.raises(ConnectionResetError):
+        load_audio(_FailingStream(data, len(data) // 2))
+
+
+@pytest.mark.parametrize("padding", [0, N_SAMPLES])
+def test_log_mel_windows(padding: int):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    mel = log_mel_spectrogram(audio, padding=padding)
+
+    windows = LogMelWindows(audio, padding=padding, chunk_size=SAMPLE_RATE * 3)
+    assert windows.shape == mel.shape
+    for start, end in [(0, 500), (400, 900), (900, None)]:
+        assert np.allclose(windows[:, start:end], mel[:, start:end])
+
+    windows = LogMelWindows(audio_path, padding=padding, normalization="window")
+    assert windows.content_frames_until(100) == 100
+    assert windows.content_frames_until(10**6) == audio.shape[0] // 160
+    window = windows[:, 1000:4000]
+    assert window.shape == (80, 3000 if padding else 100)
+    assert window.max() - window.min() <= 2.0
+
+
+def test_mel_cache(tmp_path):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    cache = MelCache(str(tmp_path))
+
+    mel = cache.get(audio_path, padding=N_SAMPLES)
+    assert np.array_equal(mel, log_mel_spectrogram(audio, padding=N_SAMPLES))
+    assert np.array_equal(cache.get(audio_path, padding=N_SAMPLES), mel)
+    assert cache.key(audio_path) != cache.key(audio_path, padding=N_SAMPLES)
+    assert cache.key(audio) != cache.key(audio[1:])
+    assert len(os.listdir(tmp_path)) == 1
+
+    # the least recently used entry is evicted once the cache is full
+    cache.max_size = mel.numel() * 4 + 1024
+    cache.get(audio[: SAMPLE_RATE * 5])
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_log_mel_spectrogram_batch():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    audio = load_audio(audio_path)
+    clips = [audio[:12345], audio_path, audio[5000:90000]]
+
+    mel, n_frames = log_mel_spectrogram_batch(clips, padding=N_SAMPLES)
+    assert mel.shape == (3, 80, n_frames.max())
+    for i, clip in enumerate(clips):
+        expected = log_mel_spectrogram(clip, padding=N_SAMPLES)
+        assert n_frames[i] == expected.shape[-1]
+        assert np.allclose(mel[i, :, : n_frames[i]], expected)
+        assert np.all(mel[i, :, n_frames[i] :].numpy() == 0)
+
+
+def test_load_audio_in_process(tmp_path):
+    audio = load_audio(os.path.join(os.path.dirname(__file__), "jfk.flac"))
+    pcm = (audio * 32768).astype("<i2")
+
+    wav_path = str(tmp_path / "jfk.wav")
+    with wave.open(wav_path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+
+    assert _decode_in_process(wav_path, SAMPLE_RATE, None) is not None
+    assert _decode_in_process(wav_path, 8000, None) is None
+    assert np.array_equal(load_audio(wav_path), audio)
+    chunks = list(load_audio_chunks(wav_path, chunk_size=SAMPLE_RATE * 4))
+    assert np.array_equal(np.concatenate(chunks), audio)
+
+    soundfile = pytest.importorskip("soundfile")
+    flac_path = str(tmp_path / "jfk.flac")
+    soundfile.write(flac_path, pcm, SAMPLE_RATE, subtype="PCM_16")
+    assert _decode_in_process(flac_path, SAMPLE_RATE, None) is not None
+    assert np.array_equal(load_audio(flac_path), audio)
+
+
+@pytest.mark.parametrize("orig_sr", [8000, 22050, 44100, 48000])
+def test_resample(orig_sr: int):
+    audio = np.random.default_rng(42).standard_normal(orig_sr * 2).astype(np.float32)
+    gcd = np.gcd(orig_sr, SAMPLE_RATE)
+    expected = scipy.signal.resample_poly(
+        audio, SAMPLE_RATE // gcd, orig_sr // gcd
+    ).astype(np.float32)
+
+    resampled = resample(audio, orig_sr)
+    assert resampled.dtype == np.float32
+    assert resampled.shape == expected.shape
+    assert np.allclose(resampled, expected, atol=1e-5)
+    assert torch.allclose(
+        resample(torch.from_numpy(audio), orig_sr), torch.from_numpy(resampled)
+    )
+
+    mel = log_mel_spectrogram(audio, sample_rate=orig_sr)
+    assert np.allclose(mel, log_mel_spectrogram(resampled), atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "dtype,step", [("float16", 2**-10), ("int16", 2 / 65535), ("uint8", 2 / 255)]
+)
+def test_compact_mel(dtype, step):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    expected = log_mel_spectrogram(audio_path, padding=N_SAMPLES)
+
+    for source in [expected, LogMelWindows(audio_path, padding=N_SAMPLES)]:
+        mel = CompactMel(source, dtype)
+        assert mel.shape == expected.shape
+        assert mel.data.dtype == getattr(torch, dtype)
+        assert mel.max_error <= step / 2 + 1e-6
+
+        window = mel[:, 1000:4000]
+        assert window.dtype == torch.float32
+        assert torch.allclose(window, expected[:, 1000:4000], atol=step / 2 + 1e-6)
@@ -0,0 +1,62 @@
+import os.path
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from whisper import audio, audio_numpy
+
+
+def test_import_without_torch():
+    code = "import sys, whisper.audio_numpy; assert 'torch' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_mel_filters():
+    expected = audio.mel_filters("cpu").numpy()
+    assert np.array_equal(audio_numpy.mel_filters(), expected)
+
+
+@pytest.mark.parametrize("padding", [0, audio.N_SAMPLES])
+def test_log_mel_spectrogram(padding):
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    waveform = audio_numpy.load_audio(audio_path)
+
+    expected = audio.log_mel_spectrogram(waveform, padding=padding).numpy()
+    mel = audio_numpy.log_mel_spectrogram(waveform, padding=padding, block_frames=700)
+
+    assert mel.dtype == np.float32
+    assert mel.shape == expected.shape
+    assert np.allclose(mel, expected, atol=1e-4)
+
+
+def test_prefetch_log_mel_spectrograms():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    expected = audio_numpy.log_mel_spectrogram(audio_path, padding=audio.N_SAMPLES)
+
+    files = [audio_path] * 3
+    mels = audio_numpy.prefetch_log_mel_spectrograms(
+        files, num_workers=2, padding=audio.N_SAMPLES
+    )
+    for file, (prefetched_file, mel) in zip(files, mels):
+        assert prefetched_file == file
+        assert np.array_equal(mel, expected)
+
+
+# lossy codecs cannot be seeked to the exact sample and are decoded by a single process
+@pytest.mark.parametrize("extension", ["flac", "wav", "ogg", "m4a", "mp3"])
+def test_load_audio_parallel(tmp_path, extension):
+    audio_path = str(tmp_path / f"chirp.{extension}")
+    # fmt: off
+    subprocess.run([
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-f", "lavfi", "-i", "sine=frequency=440:beep_factor=4:sample_rate=44100:duration=150",
+        "-ac", "2", audio_path,
+    ], check=True)
+    # fmt: on
+
+    expected = audio_numpy.load_audio(audio_path)
+    if extension in ("flac", "wav"):
+        assert expected.shape[0] == 150 * audio.SAMPLE_RATE
+    assert np.array_equal(audio_numpy.load_audio(audio_path, num_workers=3), expected)
@@ -0,0 +1,105 @@
+import torch
+
+from whisper import decoder
+from whisper.decoding import PyTorchInference
+
+
+def test_cross_kv_caches_reused_for_same_window(random_model):
+    model = random_model()
+    audio_features = torch.randn(1, 1500, 128)
+
+    computed = decoder.totalCrossKVComputed
+    with torch.no_grad():
+        k, v = model.decoder.crossKVCaches(audio_features)
+        # fallback decodes DecodingResult.audio_features, a view of the same memory
+        reused_k, reused_v = model.decoder.crossKVCaches(audio_features[0][None])
+        assert reused_k is k and reused_v is v
+        assert decoder.totalCrossKVComputed == computed + 1
+
+        other_k, _ = model.decoder.crossKVCaches(audio_features.clone())
+        assert other_k is not k
+        assert torch.equal(other_k, k)
+
+        audio_features += 1
+        changed_k, _ = model.decoder.crossKVCaches(audio_features)
+        assert not torch.equal(changed_k, k)
+        assert decoder.totalCrossKVComputed == computed + 3
+
+    assert k.shape == (2, 2, 64, 1500)
+    assert v.shape == (2, 2, 1500, 64)
+
+
+def test_quantize_int8(random_model):
+    model = random_model()
+    model.load_state_dict(
+        model.state_dict()
+    )  # fuses the qk scale, as load_model() does
+    mel = torch.randn(1, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50359]])
+
+    with torch.no_grad():
+        expected_features = model.encoder(mel)
+        expected_logits = model.decoder(tokens, expected_features, 0)[0]
+
+        model.quantize_int8()
+        features = model.encoder(mel)
+        logits = model.decoder(tokens, features, 0)[0]
+
+    assert not any(isinstance(m, torch.nn.Linear) for m in model.modules())
+    assert (
+        features - expected_features
+    ).abs().max() < 0.05 * expected_features.abs().max()
+    assert (logits - expected_logits).abs().max() < 0.05 * expected_logits.abs().max()
+    assert torch.equal(
+        logits[0, -1].topk(5).indices, expected_logits[0, -1].topk(5).indices
+    )
+
+
+def test_to_bf16(random_model):
+    model = random_model()
+    mel = torch.randn(1, 80, 3000)
+
+    with torch.no_grad():
+        expected = model.encoder(mel)
+        model.to_bf16()
+        features = model.encoder(mel.bfloat16())
+        inference = PyTorchInference(model, 3)
+        model.text_offset = 0
+        logits, _ = inference.logits(torch.tensor([[50258, 50259, 50359]]), features)
+
+    assert model.dtype == torch.bfloat16
+    assert model.decoder.ln.weight.dtype == torch.float32
+    assert features.dtype == torch.bfloat16
+    assert (features.float() - expected).abs().max() < 0.05 * expected.abs().max()
+    assert logits.dtype == torch.float32
+    assert model.masked_kv_caches.dtype == torch.bfloat16
+
+
+def test_fuse_qkv(random_model):
+    model = random_model()
+    for module in model.modules():
+        if isinstance(module, torch.nn.LayerNorm):
+            # the identity affine of a fresh LayerNorm would fold into nothing
+            torch.nn.init.normal_(module.weight, 1.0, 0.2)
+            torch.nn.init.normal_(module.bias, 0.0, 0.2)
+    mel = torch.randn(1, 80, 3000)
+    tokens = torch.tensor([[50258, 50259, 50359, 50363]])
+
+    def run():
+        features = model.encoder(mel)
+        inference = PyTorchInference(model, 3)
+        model.text_offset = 0
+        logits = [inference.logits(tokens[:, :3], features)[0][:, -1]]
+        logits.append(inference.logits(tokens, features)[0][:, -1])
+        return features, torch.cat(logits)
+
+    with torch.no_grad():
+        expected_features, expected_logits = run()
+        model.fuse_qkv()
+        features, logits = run()
+
+    block = model.decoder.blocks[0]
+    assert block.attn.query is None and block.attn.qkv.out_features == 3 * 128
+    assert block.attn_ln.weight is None and block.cross_attn_ln.weight is None
+    torch.testing.assert_close(features, expected_features, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(logits, expected_logits, rtol=1e-4, atol=1e-3)
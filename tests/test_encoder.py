@@ -0,0 +1,177 @@
+import copy
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from whisper.decoding import DecodingOptions
+from whisper.encoder import MultiHeadAttention
+from whisper.model import Whisper
+
+
+def test_batched_attention():
+    torch.manual_seed(0)
+    attn = MultiHeadAttention(n_state=64, n_head=4).eval()
+    x = torch.randn(1, 1500, 64)
+
+    with torch.no_grad():
+        expected = attn.out(attn.batched_attention(x))
+        MultiHeadAttention.use_sdpa = False
+        try:
+            looped = attn(x)
+        finally:
+            MultiHeadAttention.use_sdpa = True
+        batched = attn(x)
+
+    assert torch.allclose(batched, expected)
+    assert torch.allclose(batched, looped, atol=1e-5)
+
+
+def test_conversion_blocks(random_model):
+    model = random_model(n_state=64, n_head=4, n_audio_layer=2)
+    mel = torch.randn(1, 80, 3000)
+    x = torch.randn(1, 1500, 64)
+
+    with torch.no_grad():
+        expected = model.encoder(mel)
+        runtime_graph = str(torch.jit.trace(model.encoder.blocks[0], x).inlined_graph)
+        state_dict = model.state_dict()
+
+        # conversion traces the per-head loop, which is laid out for the Neural Engine
+        encoder = model.encoder.for_conversion()
+        converted = encoder(mel)
+        conversion_graph = str(torch.jit.trace(encoder.blocks[0], x).inlined_graph)
+
+    assert torch.allclose(converted, expected, atol=1e-4)
+    assert model.state_dict().keys() == state_dict.keys()
+    if hasattr(F, "scaled_dot_product_attention"):  # torch >= 2.0
+        assert "scaled_dot_product_attention" in runtime_graph
+    assert "einsum" not in runtime_graph and "aten::cat" not in runtime_graph
+    assert "einsum" in conversion_graph and "aten::cat" in conversion_graph
+    assert "scaled_dot_product_attention" not in conversion_graph
+
+
+@pytest.mark.parametrize("use_sdpa", [True, False])
+def test_encode_windows(use_sdpa: bool, random_model):
+    model = random_model(n_state=64, n_head=4, n_audio_layer=2)
+    mels = torch.randn(5, 80, 3000)
+
+    MultiHeadAttention.use_sdpa = use_sdpa
+    try:
+        with torch.no_grad():
+            expected = torch.cat([model.encoder(mel[None]) for mel in mels])
+        features = model.encode_windows(mels, batch_size=2)
+    finally:
+        MultiHeadAttention.use_sdpa = True
+
+    assert features.shape == (5, 1500, 64)
+    assert torch.allclose(features, expected, atol=1e-5)
+
+
+# a window of 128 frames is as wide as the model's n_state; it is still a spectrogram
+@pytest.mark.parametrize("n_frames", [1000, 128])
+def test_short_tail(n_frames: int, random_model):
+    model = random_model()
+    mel = torch.randn(80, n_frames)
+    encoder_calls = []
+    model.encoder.register_forward_hook(lambda *args: encoder_calls.append(1))
+
+    options = DecodingOptions(language="en", fp16=False, sample_len=4)
+    result = model.decode(mel, options)
+    assert result.audio_features.shape == (n_frames // 2, 128)
+    assert len(encoder_calls) == 1
+
+    # the given features of a short window are not encoded again
+    again = model.decode(mel, options, result.audio_features)
+    assert torch.equal(again.audio_features, result.audio_features)
+    assert again.tokens == result.tokens
+    assert len(encoder_calls) == 1
+
+
+def test_compile_encoder(tmp_path, random_model):
+    model = random_model(n_state=64, n_head=4, n_audio_layer=2)
+    mels = torch.randn(2, 80, 3000)
+
+    with torch.no_grad():
+        expected = model.encoder(mels)
+        model.compile_encoder(str(tmp_path))
+        (path,) = tmp_path.iterdir()
+        name, weights, fingerprint, version = path.stem.split("-", 3)
+        assert (name, weights, version) == (
+            "test",
+            "float32",
+            f"torch{torch.__version__}",
+        )
+        assert torch.allclose(model.encoder(mels[:1]), expected[:1], atol=1e-5)
+
+        # a later process loads the saved graph instead of tracing it again
+        other = random_model(n_state=64, n_head=4, n_audio_layer=2)
+        other.compile_encoder(str(tmp_path))
+        assert torch.allclose(other.encoder(mels[1:]), expected[1:], atol=1e-5)
+        assert len(list(tmp_path.iterdir())) == 1
+
+        # different weights under the same name are compiled into a graph of their own
+        torch.manual_seed(1)
+        other = Whisper(model.dims, use_coreml=False, modelName="test").eval()
+        other.compile_encoder(str(tmp_path))
+        assert len(list(tmp_path.iterdir())) == 2
+        # the SHA-256 of an official checkpoint is used as it is
+        other.checkpoint_sha256 = "ab" * 32
+        other.compile_encoder(str(tmp_path))
+        assert (
+            tmp_path / f"test-float32-{'ab' * 8}-torch{torch.__version__}.pt"
+        ).exists()
+
+        # batches of windows are not what was traced and run eagerly
+        assert torch.allclose(model.encoder(mels), expected, atol=1e-5)
+
+
+def test_compiled_encoder_after_changes(tmp_path, random_model):
+    model = random_model(n_state=64, n_head=4, n_audio_layer=2)
+    eager = copy.deepcopy(model)
+    mel = torch.randn(1, 80, 3000)
+
+    with torch.no_grad():
+        model.compile_encoder(str(tmp_path))
+        assert not any(isinstance(m, torch.jit.ScriptModule) for m in model.modules())
+
+        # a graph compiled for other weights is not used, and is dropped for good
+        for m in (model, eager):
+            m.encoder.blocks[0].mlp[0].weight.mul_(2)
+        with pytest.warns(UserWarning, match="changed since it was compiled"):
+            assert torch.allclose(model.encoder(mel), eager.encoder(mel), atol=1e-5)
+        assert model.encoder.compiled is None
+
+        # nor one of another dtype
+        model.compile_encoder(str(tmp_path))
+        model.to_bf16()
+        eager.to_bf16()
+        with pytest.warns(UserWarning, match="changed since it was compiled"):
+            features = model.encoder(mel.bfloat16())
+        assert features.dtype == torch.bfloat16
+        assert torch.equal(features, eager.encoder(mel.bfloat16()))
+
+
+def test_limit_memory(random_model):
+    model = random_model(n_state=64, n_head=4, n_audio_layer=13)
+    mels = torch.randn(2, 80, 3000)
+    x = torch.randn(1, 1500, 64)
+
+    with torch.no_grad():
+        expected = model.encoder(mels)
+        expected_tail = model.encoder(mels[:1, :, :1000])
+        model.encoder.from_block_idx = 12
+        expected_block12 = model.encoder.block12(x)
+
+        model.encoder.limit_memory(160)
+        features = model.encoder(mels)
+        tail = model.encoder(mels[:1, :, :1000])
+        x_before = x.clone()
+        model.encoder.from_block_idx = 12
+        block12 = model.encoder.block12(x)
+
+    assert torch.allclose(features, expected, atol=1e-5)
+    assert torch.allclose(tail, expected_tail, atol=1e-5)
+    assert torch.allclose(block12, expected_block12, atol=1e-5)
+    # the in-place residual adds leave the input of a later block12 alone
+    assert torch.equal(x, x_before)
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import torch
+
+import whisper
+from whisper.decoding import DecodingOptions
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+
+@pytest.mark.parametrize("beam_size", [None, 3])
+def test_onnx_backend(tmp_path, monkeypatch, beam_size, random_model):
+    model = random_model()
+    checkpoint = {"dims": model.dims.__dict__, "model_state_dict": model.state_dict()}
+    torch.save(checkpoint, tmp_path / "test.pt")
+
+    # the models are exported to, and loaded from, ./onnx/test.pt
+    monkeypatch.chdir(tmp_path)
+    root = os.path.dirname(os.path.dirname(__file__))
+    env = dict(os.environ, PYTHONPATH=root)
+    script = os.path.join(root, "convert_onnx.py")
+    subprocess.run([sys.executable, script, "test.pt"], env=env, check=True)
+
+    mel = torch.randn(80, 3000)
+    options = DecodingOptions(
+        language="en", fp16=False, sample_len=8, beam_size=beam_size
+    )
+    results = [
+        whisper.load_model("test.pt", device="cpu", backend=backend).decode(
+            mel, options
+        )
+        for backend in ["pytorch", "onnx"]
+    ]
+
+    assert torch.allclose(
+        results[0].audio_features, results[1].audio_features, atol=1e-4
+    )
+    assert results[0].tokens == results[1].tokens
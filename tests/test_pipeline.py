@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from whisper.pipeline import PipelineEncoder
+
+
+def test_pipeline_encoder(random_model):
+    # 13 blocks make two stages
+    model = random_model(n_state=64, n_head=4, n_audio_layer=13)
+    mels = torch.randn(5, 80, 3000)
+
+    expected = model.encode_windows(mels, batch_size=2)
+    with PipelineEncoder(model.encoder, threads_per_stage=1) as pipeline:
+        assert len(pipeline.workers) == 2
+        features = pipeline.encode_windows(mels, batch_size=2)
+
+        # an error in a stage is raised in order, and the pipeline keeps working
+        windows = pipeline.encode([mels[:1], torch.randn(1, 3, 3000), mels[1:2]])
+        assert torch.allclose(next(windows), expected[:1], atol=1e-5)
+        with pytest.raises(RuntimeError):
+            next(windows)
+        assert torch.allclose(
+            pipeline.encode_windows(mels[:1]), expected[:1], atol=1e-5
+        )
+
+    assert torch.allclose(features, expected, atol=1e-5)
+    assert all(not worker.is_alive() for worker in pipeline.workers)
@@ -1,9 +1,12 @@
+import importlib
 import os
 
+import numpy as np
 import pytest
 import torch
 
 import whisper
+from whisper.audio import N_FRAMES, SAMPLE_RATE
 from whisper.tokenizer import get_tokenizer
 
 
@@ -40,3 +43,54 @@ def test_transcribe(model_name: str):
                 timing_checked = True
 
     assert timing_checked
+
+
+@pytest.mark.parametrize("incremental_mel", [None, "window"])
+def test_transcribe_long_audio(random_model, incremental_mel):
+    # a random-weight model runs offline; only the windowing over the audio is checked
+    model = random_model()
+    audio = np.random.default_rng(0).standard_normal(40 * SAMPLE_RATE) * 0.1
+    result = model.transcribe(
+        audio.astype(np.float32),
+        language="en",
+        temperature=0.0,
+        fp16=False,
+        sample_len=4,
+        no_speech_threshold=None,
+        condition_on_previous_text=False,
+        incremental_mel=incremental_mel,
+    )
+
+    seeks = sorted({segment["seek"] for segment in result["segments"]})
+    assert seeks[0] == 0
+    # the second window starts where the first one ended, within the first 30 seconds
+    assert len(seeks) > 1 and 0 < seeks[1] <= N_FRAMES
+
+
+def test_fallback_reuses_audio_features(random_model):
+    model = random_model()
+    encoder_calls = []
+    model.encoder.register_forward_hook(lambda *args: encoder_calls.append(1))
+    # the module, which `whisper.transcribe` is not: the package exports the function by that name
+    transcribe_module = importlib.import_module("whisper.transcribe")
+    passes = transcribe_module.totalEncoderPasses
+    passes_saved = transcribe_module.totalEncoderPassesSaved
+
+    audio = np.random.default_rng(0).standard_normal(10 * SAMPLE_RATE) * 0.1
+    temperatures = (0.0, 0.2, 0.4)
+    result = model.transcribe(
+        audio.astype(np.float32),
+        language="en",
+        temperature=temperatures,
+        fp16=False,
+        sample_len=4,
+        # every attempt is too repetitive, so that all temperatures are tried
+        compression_ratio_threshold=0.0,
+        logprob_threshold=None,
+        no_speech_threshold=None,
+    )
+
+    assert result["segments"][0]["temperature"] == temperatures[-1]
+    assert len(encoder_calls) == 1
+    assert transcribe_module.totalEncoderPasses - passes == 1
+    assert transcribe_module.totalEncoderPassesSaved - passes_saved == 2
@@ -0,0 +1,37 @@
+import numpy as np
+
+from whisper.audio import FRAMES_PER_SECOND, SAMPLE_RATE, log_mel_spectrogram
+from whisper.vad import WindowPlan, plan_windows, speech_regions
+
+
+def test_speech_regions():
+    rng = np.random.default_rng(0)
+    t = np.arange(3 * SAMPLE_RATE) / SAMPLE_RATE
+    syllables = 1 + np.sin(2 * np.pi * 3 * t)
+    speech = 0.1 * rng.standard_normal(t.shape) * syllables
+    silence = 1e-4 * rng.standard_normal(20 * SAMPLE_RATE)
+    audio = np.concatenate([speech, silence, speech]).astype(np.float32)
+
+    mel = log_mel_spectrogram(audio)
+    plan = plan_windows(mel, mel.shape[-1])
+
+    assert len(plan.regions) == 2
+    (start1, end1), (start2, end2) = plan.regions
+    assert start1 == 0 and end1 < 4 * FRAMES_PER_SECOND
+    assert 22 * FRAMES_PER_SECOND < start2 < 23 * FRAMES_PER_SECOND
+    assert end2 == mel.shape[-1]
+
+    assert plan.next_seek(100) == 100
+    assert plan.next_seek(end1) == start2
+    assert plan.next_seek(start2 + 10) == start2 + 10
+    assert plan.skipped_frames == start2 - end1
+    assert plan.summary()["skipped_regions"] == 1
+
+
+def test_speech_regions_without_silence():
+    assert speech_regions(np.full(1000, 0.5)) == [(0, 1000)]
+    assert speech_regions(np.zeros(0)) == []
+
+    plan = WindowPlan([], 500)
+    assert plan.next_seek(0) == 500
+    assert plan.skipped_frames == 500
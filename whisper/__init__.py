@@ -1,19 +1,49 @@
 import hashlib
 import io
 import os
+import sys
+import types
 import urllib
 import warnings
-from typing import List, Optional, Union
+from typing import TYPE_CHECKING, List, Optional, Union
 
-import torch
 from tqdm import tqdm
 
-from .audio import load_audio, log_mel_spectrogram, pad_or_trim
-from .decoding import DecodingOptions, DecodingResult, decode, detect_language
-from .model import ModelDimensions, Whisper
-from .transcribe import transcribe
 from .version import __version__
-from .coreml import Coreml
+
+if TYPE_CHECKING:
+    import torch
+
+    from .model import Whisper
+
+# the names below come from modules that import torch, which are only loaded on first use so that
+# processes using no more than `whisper.audio_numpy` do not pay for importing torch
+_TORCH_ATTRIBUTES = {
+    "load_audio",
+    "log_mel_spectrogram",
+    "pad_or_trim",
+    "DecodingOptions",
+    "DecodingResult",
+    "decode",
+    "detect_language",
+    "ModelDimensions",
+    "Whisper",
+    "transcribe",
+    "Coreml",
+}
+_TORCH_MODULES = {
+    "audio",
+    "coreml",
+    "decoder",
+    "decoding",
+    "encoder",
+    "model",
+    "timing",
+    "tokenizer",
+    "transcribe",
+    "utils",
+    "vad",
+}
 
 _MODELS = {
     "tiny.en": "https://openaipublic.azureedge.net/main/whisper/models/d3dd57d32accea0b295c96e26691aa14d8822fac7d9d27d5dc00b4ca2826dd03/tiny.en.pt",
@@ -90,6 +120,37 @@ def _download(url: str, root: str, in_memory: bool) -> Union[bytes, str]:
     return model_bytes if in_memory else download_target
 
 
+def _import_torch_modules():
+    global load_audio, log_mel_spectrogram, pad_or_trim
+    global DecodingOptions, DecodingResult, decode, detect_language
+    global ModelDimensions, Whisper, transcribe, Coreml
+
+    from .audio import load_audio, log_mel_spectrogram, pad_or_trim
+    from .decoding import DecodingOptions, DecodingResult, decode, detect_language
+    from .model import ModelDimensions, Whisper
+    from .transcribe import transcribe
+    from .coreml import Coreml
+
+
+def __getattr__(name: str):
+    if name in _TORCH_ATTRIBUTES or name in _TORCH_MODULES:
+        _import_torch_modules()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class _WhisperModule(types.ModuleType):
+    def __setattr__(self, name: str, value):
+        # loading the `whisper.transcribe` submodule before the function was looked up would
+        # otherwise shadow `whisper.transcribe()` with the module
+        if name in _TORCH_ATTRIBUTES and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _WhisperModule
+
+
 def available_models() -> List[str]:
     """Returns the names of available models"""
     return list(_MODELS.keys())
@@ -97,11 +158,17 @@ def available_models() -> List[str]:
 
 def load_model(
     name: str,
-    device: Optional[Union[str, torch.device]] = None,
+    device: Optional[Union[str, "torch.device"]] = None,
     download_root: str = None,
     in_memory: bool = False,
     use_coreml: bool = False,
-) -> Whisper:
+    int8: bool = False,
+    bf16: bool = False,
+    compile_encoder: bool = False,
+    fuse_qkv: bool = False,
+    low_memory: bool = False,
+    backend: str = "pytorch",
+) -> "Whisper":
     """
     Load a Whisper ASR model
 
@@ -116,12 +183,42 @@ def load_model(
         path to download the model files; by default, it uses "~/.cache/whisper"
     in_memory: bool
         whether to preload the model weights into host memory
+    int8: bool
+        whether to quantize the weights of the linear layers to int8 for faster CPU inference,
+        see `Whisper.quantize_int8()`
+    bf16: bool
+        whether to run the model in bfloat16, see `Whisper.to_bf16()`; cannot be combined with `int8`
+    compile_encoder: bool
+        whether to run the encoder through a frozen TorchScript graph on the CPU, which is compiled
+        once and kept in the "compiled" folder of `download_root`, see `Whisper.compile_encoder()`
+    fuse_qkv: bool
+        whether to run the query, key and value projections of each attention as one GEMM with
+        the LayerNorms folded into the projections, see `Whisper.fuse_qkv()`
+    low_memory: bool
+        whether to run the encoder with a bounded peak memory, in chunks of frames and with
+        in-place residual adds, see `AudioEncoder.limit_memory()`
+    backend: str
+        "pytorch", "coreml", the same as `use_coreml`, or "onnx" to run the encoder, the cross
+        attention caches and the decoder blocks with ONNX Runtime on the CPU from the models
+        exported to "./onnx/{name}" by convert_onnx.py; other input shapes, and the decoding
+        steps of a single beam, run in PyTorch
 
     Returns
     -------
     model : Whisper
         The Whisper ASR model instance
     """
+    import torch
+
+    _import_torch_modules()
+
+    if backend not in ("pytorch", "coreml", "onnx"):
+        raise ValueError(f"Unknown backend {backend}; use pytorch, coreml or onnx")
+    use_coreml = use_coreml or backend == "coreml"
+    if backend == "onnx" and (int8 or bf16 or compile_encoder):
+        raise ValueError(
+            "The ONNX models are float32; int8, bf16 and compile_encoder are not available"
+        )
 
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -155,6 +252,8 @@ def load_model(
 
     if alignment_heads is not None:
         model.set_alignment_heads(alignment_heads)
+    if name in _MODELS:
+        model.checkpoint_sha256 = _MODELS[name].split("/")[-2]
 
     if use_coreml:
         coreml = Coreml(dims.n_text_layer,
@@ -165,7 +264,29 @@ def load_model(
         model.encoder.coreml = coreml
         model.decoder.coreml = coreml
 
-    return model.to(device)
+    model = model.to(device)
+    if fuse_qkv:
+        model.fuse_qkv()
+    if low_memory:
+        model.encoder.limit_memory()
+    if bf16:
+        model.to_bf16()
+    if int8:
+        model.quantize_int8()
+    if compile_encoder:
+        model.compile_encoder(os.path.join(download_root, "compiled"))
+    if backend == "onnx":
+        from .onnx import Onnx
+
+        onnx = Onnx(dims.n_text_layer,
+                    dims.n_text_state,
+                    dims.n_text_head,
+                    dims.n_vocab,
+                    name)
+        model.encoder.onnx = onnx
+        model.decoder.onnx = onnx
+
+    return model
 
 def skip_coreml_load(state_dict):
     keys = list(state_dict.keys())
@@ -1,66 +1,58 @@
+import hashlib
+import math
 import os
 from functools import lru_cache
-from subprocess import CalledProcessError, run
-from typing import Optional, Union
+from typing import Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
 import torch.nn.functional as F
 
-from .utils import exact_div
+from . import audio_numpy
+from .audio_numpy import (  # noqa: F401
+    CHUNK_LENGTH,
+    FRAMES_PER_SECOND,
+    HOP_LENGTH,
+    N_FFT,
+    N_FRAMES,
+    N_MELS,
+    N_SAMPLES,
+    N_SAMPLES_PER_TOKEN,
+    SAMPLE_RATE,
+    TOKENS_PER_SECOND,
+    _decode_in_process,
+    load_audio,
+    load_audio_chunks,
+    polyphase_filters,
+)
 
-# hard-coded audio hyperparameters
-SAMPLE_RATE = 16000
-N_FFT = 400
-N_MELS = 80
-HOP_LENGTH = 160
-CHUNK_LENGTH = 30
-N_SAMPLES = CHUNK_LENGTH * SAMPLE_RATE  # 480000 samples in a 30-second chunk
-N_FRAMES = exact_div(N_SAMPLES, HOP_LENGTH)  # 3000 frames in a mel spectrogram input
 
-N_SAMPLES_PER_TOKEN = HOP_LENGTH * 2  # the initial convolutions has stride 2
-FRAMES_PER_SECOND = exact_div(SAMPLE_RATE, HOP_LENGTH)  # 10ms per audio frame
-TOKENS_PER_SECOND = exact_div(SAMPLE_RATE, N_SAMPLES_PER_TOKEN)  # 20ms per audio token
-
-
-def load_audio(file: str, sr: int = SAMPLE_RATE):
+def resample(
+    audio: Union[np.ndarray, torch.Tensor], orig_sr: int, target_sr: int = SAMPLE_RATE
+):
     """
-    Open an audio file and read as mono waveform, resampling as necessary
+    Resample a mono waveform in memory, using a polyphase filter bank cached per rate ratio
 
     Parameters
     ----------
-    file: str
-        The audio file to open
+    audio: Union[np.ndarray, torch.Tensor], shape = (n_samples,)
+        A NumPy array or Tensor containing the audio waveform
+
+    orig_sr: int
+        The sample rate of the given audio
 
-    sr: int
-        The sample rate to resample the audio if necessary
+    target_sr: int
+        The sample rate to resample the audio to
 
     Returns
     -------
-    A NumPy array containing the audio waveform, in float32 dtype.
-    """
-
-    # This launches a subprocess to decode audio while down-mixing
-    # and resampling as necessary.  Requires the ffmpeg CLI in PATH.
-    # fmt: off
-    cmd = [
-        "ffmpeg",
-        "-nostdin",
-        "-threads", "0",
-        "-i", file,
-        "-f", "s16le",
-        "-ac", "1",
-        "-acodec", "pcm_s16le",
-        "-ar", str(sr),
-        "-"
-    ]
-    # fmt: on
-    try:
-        out = run(cmd, capture_output=True, check=True).stdout
-    except CalledProcessError as e:
-        raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
-
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+    A NumPy array or Tensor, the same type as given, containing the resampled waveform in float32
+    """
+    if orig_sr == target_sr or not torch.is_tensor(audio):
+        return audio_numpy.resample(audio, orig_sr, target_sr)
+
+    output = audio_numpy.resample(audio.cpu().numpy(), orig_sr, target_sr)
+    return torch.from_numpy(output).to(audio.device)
 
 
 def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
@@ -107,11 +99,18 @@ def mel_filters(device, n_mels: int = N_MELS) -> torch.Tensor:
         return torch.from_numpy(f[f"mel_{n_mels}"]).to(device)
 
 
+@lru_cache(maxsize=None)
+def hann_window(device) -> torch.Tensor:
+    """the STFT window, built once per device instead of on every call"""
+    return torch.hann_window(N_FFT).to(device)
+
+
 def log_mel_spectrogram(
     audio: Union[str, np.ndarray, torch.Tensor],
     n_mels: int = N_MELS,
     padding: int = 0,
     device: Optional[Union[str, torch.device]] = None,
+    sample_rate: int = SAMPLE_RATE,
 ):
     """
     Compute the log-Mel spectrogram of
@@ -130,6 +129,10 @@ def log_mel_spectrogram(
     device: Optional[Union[str, torch.device]]
         If given, the audio tensor is moved to this device before STFT
 
+    sample_rate: int
+        The sample rate of the given NumPy array or Tensor, which is resampled to 16 kHz
+        in memory if it differs; ignored for paths, which ffmpeg resamples while decoding
+
     Returns
     -------
     torch.Tensor, shape = (80, n_frames)
@@ -138,13 +141,16 @@ def log_mel_spectrogram(
     if not torch.is_tensor(audio):
         if isinstance(audio, str):
             audio = load_audio(audio)
+            sample_rate = SAMPLE_RATE
         audio = torch.from_numpy(audio)
 
+    if sample_rate != SAMPLE_RATE:
+        audio = resample(audio, sample_rate)
     if device is not None:
         audio = audio.to(device)
     if padding > 0:
         audio = F.pad(audio, (0, padding))
-    window = torch.hann_window(N_FFT).to(audio.device)
+    window = hann_window(audio.device)
     stft = torch.stft(audio, N_FFT, HOP_LENGTH, window=window, return_complex=True)
     magnitudes = stft[..., :-1].abs() ** 2
 
@@ -155,3 +161,451 @@ def log_mel_spectrogram(
     log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
     log_spec = (log_spec + 4.0) / 4.0
     return log_spec
+
+
+def log_mel_spectrogram_batch(
+    audios: List[Union[str, np.ndarray, torch.Tensor]],
+    n_mels: int = N_MELS,
+    padding: int = 0,
+    device: Optional[Union[str, torch.device]] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Compute the log-Mel spectrograms of many audio clips of different lengths at once,
+    using a single batched STFT and Mel projection
+
+    Parameters
+    ----------
+    audios: List[Union[str, np.ndarray, torch.Tensor]]
+        The paths to audio or NumPy arrays or Tensors containing the audio waveforms in 16 kHz
+
+    n_mels: int
+        The number of Mel-frequency filters, only 80 is supported
+
+    padding: int
+        Number of zero samples to pad to the right of each clip
+
+    device: Optional[Union[str, torch.device]]
+        If given, the audio tensors are moved to this device before STFT
+
+    Returns
+    -------
+    torch.Tensor, shape = (n_audio, 80, max_n_frames)
+        A Tensor that contains the Mel spectrograms, zero-filled after the last frame of each clip.
+        `mel[i, :, :n_frames[i]]` is the same as `log_mel_spectrogram(audios[i])`.
+
+    torch.Tensor, shape = (n_audio,)
+        The number of valid frames of each clip
+    """
+    clips = []
+    for audio in audios:
+        if not torch.is_tensor(audio):
+            if isinstance(audio, str):
+                audio = load_audio(audio)
+            audio = torch.from_numpy(audio)
+        if device is not None:
+            audio = audio.to(device)
+        clips.append(audio)
+
+    # apply the reflect padding of `torch.stft(center=True)` to each clip on its own,
+    # so that zero-filling the shorter clips doesn't change their last frames
+    n_samples = [clip.shape[-1] + padding for clip in clips]
+    n_frames = torch.tensor([n // HOP_LENGTH for n in n_samples])
+    batch = clips[0].new_zeros(len(clips), max(n_samples) + N_FFT)
+    for i, clip in enumerate(clips):
+        clip = F.pad(clip, (0, padding))
+        clip = F.pad(clip[None, None], (N_FFT // 2, N_FFT // 2), mode="reflect")[0, 0]
+        batch[i, : clip.shape[-1]] = clip
+
+    window = hann_window(batch.device)
+    stft = torch.stft(
+        batch, N_FFT, HOP_LENGTH, window=window, center=False, return_complex=True
+    )
+    magnitudes = stft[..., : n_frames.max()].abs() ** 2
+
+    filters = mel_filters(batch.device, n_mels)
+    mel_spec = filters @ magnitudes
+
+    valid = torch.arange(magnitudes.shape[-1]) < n_frames[:, None]
+    valid = valid[:, None, :].to(batch.device)
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    max_values = log_spec.masked_fill(~valid, -np.inf).amax(dim=(1, 2), keepdim=True)
+    log_spec = torch.maximum(log_spec, max_values - 8.0)
+    log_spec = (log_spec + 4.0) / 4.0
+    return log_spec.masked_fill(~valid, 0.0), n_frames
+
+
+class LogMelWindows:
+    """
+    Computes the log-Mel spectrogram of an audio window by window, so that only a few windows
+    of audio and Mel frames are held in memory at any time during long-form transcription.
+
+    Slicing with `mel[:, start:end]` returns the same frames as `log_mel_spectrogram()` of the
+    whole audio would, computing the STFT frames of that range on demand, including the reflect
+    padding at the edges of the audio. Frames are expected to be requested in a non-decreasing
+    order of `start`; audio before the requested window is released, and requesting an earlier
+    window restarts decoding from the beginning.
+
+    Parameters
+    ----------
+    audio: Union[str, np.ndarray, torch.Tensor], shape = (*)
+        The path to audio or either a NumPy array or Tensor containing the audio waveform in 16 kHz.
+        Audio files are decoded incrementally using `load_audio_chunks()`.
+
+    n_mels: int
+        The number of Mel-frequency filters, only 80 is supported
+
+    padding: int
+        Number of zero samples to pad to the right
+
+    normalization: str
+        "global" normalizes with the maximum over the whole spectrogram, like
+        `log_mel_spectrogram()`; this needs a first pass over the audio, which decodes
+        audio files twice. "window" normalizes each requested window on its own, which needs
+        a single pass and lets decoding of an audio file overlap with the transcription.
+
+    device: Optional[Union[str, torch.device]]
+        If given, the audio is moved to this device before STFT
+
+    chunk_size: int
+        The number of audio samples read from the source at a time
+    """
+
+    def __init__(
+        self,
+        audio: Union[str, np.ndarray, torch.Tensor],
+        n_mels: int = N_MELS,
+        padding: int = 0,
+        normalization: str = "global",
+        device: Optional[Union[str, torch.device]] = None,
+        chunk_size: int = N_SAMPLES,
+    ):
+        if normalization not in ("global", "window"):
+            raise ValueError(f"Unsupported normalization: {normalization}")
+
+        self.audio = audio if isinstance(audio, str) else torch.as_tensor(audio)
+        self.n_mels = n_mels
+        self.padding = padding
+        self.normalization = normalization
+        self.device = device
+        self.chunk_size = chunk_size
+
+        # the number of audio samples, only known after the source has been read to its end
+        self.n_samples: Optional[int] = None
+        self._rewind()
+
+        self.global_max: Optional[float] = None
+        if normalization == "global":
+            self.global_max = self._find_global_max()
+            self._rewind()
+
+    @property
+    def content_frames(self) -> Optional[int]:
+        """The number of frames without padding, or None if the audio is not fully read yet"""
+        if self.n_samples is None:
+            return None
+        return self.n_samples // HOP_LENGTH
+
+    @property
+    def n_frames(self) -> int:
+        """The number of frames including padding; reads the audio to its end if necessary"""
+        if self.n_samples is None:
+            self.n_samples = sum(chunk.shape[0] for chunk in self._open_chunks())
+        return (self.n_samples + self.padding) // HOP_LENGTH
+
+    @property
+    def shape(self):
+        return (self.n_mels, self.n_frames)
+
+    def content_frames_until(self, limit: int) -> int:
+        """The number of frames without padding, counting at most up to `limit` frames"""
+        self._read_until(limit * HOP_LENGTH)
+        if not self._exhausted:
+            return limit
+        return min(limit, self.content_frames)
+
+    def __getitem__(self, key) -> torch.Tensor:
+        if not isinstance(key, tuple) or len(key) != 2 or key[0] != slice(None):
+            raise IndexError("only mel[:, start:end] slicing is supported")
+        frames = key[1]
+        if frames.step not in (None, 1):
+            raise IndexError("only contiguous slices of frames are supported")
+
+        start = frames.start or 0
+        end = frames.stop if frames.stop is not None else self.n_frames
+        if start < 0 or end < 0:
+            raise IndexError("negative frame indices are not supported")
+
+        log_spec = self._log_spec(start, end)
+        if log_spec.numel() == 0:
+            return log_spec
+
+        if self.normalization == "global":
+            max_value = torch.tensor(self.global_max, device=log_spec.device)
+        else:
+            max_value = log_spec.max()
+        log_spec = torch.maximum(log_spec, max_value - 8.0)
+        return (log_spec + 4.0) / 4.0
+
+    def _open_chunks(self) -> Iterator[Union[np.ndarray, torch.Tensor]]:
+        if isinstance(self.audio, str):
+            return load_audio_chunks(self.audio, chunk_size=self.chunk_size)
+        return iter(self.audio.split(self.chunk_size))
+
+    def _rewind(self):
+        self._chunks = self._open_chunks()
+        self._buffer = torch.zeros(0)
+        self._buffer_start = 0
+        self._exhausted = False
+
+    def _read_until(self, end: int):
+        """read from the source until the buffer covers up to the sample index `end`"""
+        new_chunks = [self._buffer]
+        buffer_end = self._buffer_start + self._buffer.shape[0]
+        while not self._exhausted and buffer_end < end:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.n_samples = buffer_end
+                self._exhausted = True
+                break
+            new_chunks.append(torch.as_tensor(chunk))
+            buffer_end += chunk.shape[0]
+
+        if len(new_chunks) > 1:
+            self._buffer = torch.cat(new_chunks)
+
+    def _release_until(self, start: int):
+        """drop the samples before the sample index `start` from the buffer"""
+        self._read_until(start)
+        if start > self._buffer_start:
+            self._buffer = self._buffer[start - self._buffer_start :].clone()
+            self._buffer_start = start
+
+    def _samples(self, start: int, end: int) -> torch.Tensor:
+        """samples of the zero-padded audio in [start, end), reflected beyond its edges"""
+        self._read_until(end)
+
+        index = torch.arange(start, end)
+        index = torch.where(index < 0, -index, index)
+        if self.n_samples is not None:
+            total = self.n_samples + self.padding
+            index = torch.where(index >= total, 2 * (total - 1) - index, index)
+
+        buffer_end = self._buffer_start + self._buffer.shape[0]
+        in_buffer = index < buffer_end
+        in_buffer &= index >= self._buffer_start
+        samples = torch.zeros(end - start, dtype=self._buffer.dtype)
+        samples[in_buffer] = self._buffer[index[in_buffer] - self._buffer_start]
+        return samples
+
+    def _log_spec(self, start: int, end: int) -> torch.Tensor:
+        """un-normalized log-Mel frames in [start, end)"""
+        first_sample = start * HOP_LENGTH - N_FFT // 2
+        # the samples before 0 are reflected from those after it, see `_samples()`
+        if max(first_sample, 0) < self._buffer_start:
+            self._rewind()
+        self._release_until(first_sample)
+
+        # STFT frames are centered at multiples of HOP_LENGTH, see `torch.stft(center=True)`
+        self._read_until((end - 1) * HOP_LENGTH + N_FFT // 2)
+        if self.n_samples is not None:
+            end = min(end, (self.n_samples + self.padding) // HOP_LENGTH)
+        if end <= start:
+            return torch.zeros(self.n_mels, 0, device=self.device)
+
+        audio = self._samples(first_sample, (end - 1) * HOP_LENGTH + N_FFT // 2)
+        if self.device is not None:
+            audio = audio.to(self.device)
+        window = hann_window(audio.device)
+        stft = torch.stft(
+            audio, N_FFT, HOP_LENGTH, window=window, center=False, return_complex=True
+        )
+        magnitudes = stft.abs() ** 2
+
+        filters = mel_filters(audio.device, self.n_mels)
+        mel_spec = filters @ magnitudes
+
+        return torch.clamp(mel_spec, min=1e-10).log10()
+
+    def _find_global_max(self) -> float:
+        global_max = -np.inf
+        start = 0
+        while True:
+            log_spec = self._log_spec(start, start + N_FRAMES)
+            if log_spec.shape[-1] == 0:
+                break
+            global_max = max(global_max, log_spec.max().item())
+            start += N_FRAMES
+        return global_max
+
+
+class CompactMel:
+    """
+    Holds a log-Mel spectrogram in less memory than float32 for long-form transcription, either
+    as float16 or as uint8/int16 codes with a per-file scale and offset, and converts it back to
+    float32 one window at a time when sliced with `mel[:, start:end]`.
+
+    The normalized log-Mel values of a spectrogram lie within 2.0 below its maximum, so the
+    quantization step is 2.0 / 255 for uint8 and 2.0 / 65535 for int16. The largest and the
+    root-mean-square error against the float32 spectrogram are measured while converting, in
+    `max_error` and `rms_error`.
+
+    Parameters
+    ----------
+    mel: Union[torch.Tensor, LogMelWindows], shape = (n_mels, n_frames)
+        The float32 log-Mel spectrogram, which is converted window by window; a `LogMelWindows`
+        needs the "global" normalization, so that the value range is known up front
+
+    dtype: str
+        One of "float16", "int16" or "uint8"
+    """
+
+    def __init__(
+        self, mel: Union[torch.Tensor, "LogMelWindows"], dtype: str = "float16"
+    ):
+        if dtype not in ("float16", "int16", "uint8"):
+            raise ValueError(f"Unsupported compact mel dtype: {dtype}")
+
+        if isinstance(mel, LogMelWindows):
+            if mel.normalization != "global":
+                raise ValueError("compact mel storage needs the global normalization")
+            max_value = (mel.global_max + 4.0) / 4.0
+        else:
+            max_value = mel.max().item()
+
+        self.dtype = getattr(torch, dtype)
+        if self.dtype.is_floating_point:
+            self.scale, self.offset = 1.0, 0.0
+        else:
+            info = torch.iinfo(self.dtype)
+            self.scale = 2.0 / (info.max - info.min)
+            self.offset = max_value - info.max * self.scale
+
+        self.data = torch.empty(mel.shape, dtype=self.dtype)
+        squared_error, self.max_error = 0.0, 0.0
+        for start in range(0, mel.shape[-1], N_FRAMES):
+            window = mel[:, start : start + N_FRAMES].float().cpu()
+            codes = self._quantize(window)
+            error = self._dequantize(codes) - window
+            self.data[:, start : start + N_FRAMES] = codes
+            squared_error += error.square().sum().item()
+            self.max_error = max(self.max_error, error.abs().max().item())
+        self.rms_error = math.sqrt(squared_error / max(self.data.numel(), 1))
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def _quantize(self, x: torch.Tensor) -> torch.Tensor:
+        if self.dtype.is_floating_point:
+            return x.to(self.dtype)
+        info = torch.iinfo(self.dtype)
+        codes = torch.round((x - self.offset) / self.scale)
+        return codes.clamp_(info.min, info.max).to(self.dtype)
+
+    def _dequantize(self, codes: torch.Tensor) -> torch.Tensor:
+        if self.dtype.is_floating_point:
+            return codes.float()
+        return codes.float() * self.scale + self.offset
+
+    def __getitem__(self, key) -> torch.Tensor:
+        return self._dequantize(self.data[key])
+
+
+class MelCache:
+    """
+    An on-disk cache of log-Mel spectrograms, stored as memory-mapped .npy files so that windows
+    can be sliced out of a cached spectrogram without loading it into memory entirely.
+
+    Entries are keyed by a fingerprint of the audio content and the audio hyperparameters, and
+    the least recently used entries are evicted when the total size exceeds `max_size` bytes.
+
+    Parameters
+    ----------
+    cache_dir: Optional[str]
+        The directory to store the spectrograms in; by default, it uses "~/.cache/whisper/mel"
+
+    max_size: int
+        The maximum total size of the cached spectrograms, in bytes
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size: int = 10 * 1024**3):
+        if cache_dir is None:
+            default = os.path.join(os.path.expanduser("~"), ".cache")
+            cache_dir = os.path.join(
+                os.getenv("XDG_CACHE_HOME", default), "whisper", "mel"
+            )
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def key(
+        self,
+        audio: Union[str, np.ndarray, torch.Tensor],
+        n_mels: int = N_MELS,
+        padding: int = 0,
+    ) -> str:
+        """Returns the cache key of the log-Mel spectrogram of the given audio"""
+        fingerprint = hashlib.sha256()
+        if isinstance(audio, str):
+            with open(audio, "rb") as f:
+                while block := f.read(1 << 20):
+                    fingerprint.update(block)
+        else:
+            if torch.is_tensor(audio):
+                audio = audio.cpu().numpy()
+            audio = np.ascontiguousarray(audio)
+            fingerprint.update(str(audio.dtype).encode())
+            fingerprint.update(memoryview(audio).cast("B"))
+
+        params = f"{SAMPLE_RATE}-{N_FFT}-{HOP_LENGTH}-{n_mels}-{padding}"
+        fingerprint.update(params.encode())
+        return fingerprint.hexdigest()
+
+    def get(
+        self,
+        audio: Union[str, np.ndarray, torch.Tensor],
+        n_mels: int = N_MELS,
+        padding: int = 0,
+    ) -> torch.Tensor:
+        """
+        Returns the log-Mel spectrogram of the audio as a Tensor backed by a memory-mapped file,
+        computing and storing it window by window if it is not in the cache yet.
+        """
+        path = os.path.join(self.cache_dir, self.key(audio, n_mels, padding) + ".npy")
+
+        if os.path.isfile(path):
+            os.utime(path)  # mark as recently used
+        else:
+            windows = LogMelWindows(audio, n_mels=n_mels, padding=padding)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            mel = np.lib.format.open_memmap(
+                temp_path, mode="w+", dtype=np.float32, shape=windows.shape
+            )
+            for start in range(0, mel.shape[-1], N_FRAMES):
+                mel[:, start : start + N_FRAMES] = windows[:, start : start + N_FRAMES]
+            mel.flush()
+            del mel
+            os.replace(temp_path, path)
+            self.evict(keep=path)
+
+        # copy-on-write mapping gives a writable array for torch without reading the file
+        return torch.from_numpy(np.load(path, mmap_mode="c"))
+
+    def evict(self, keep: Optional[str] = None):
+        """Removes the least recently used entries until the cache fits in `max_size`"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            path = os.path.join(self.cache_dir, name)
+            if path == keep:
+                continue
+            os.remove(path)
+            total_size -= size
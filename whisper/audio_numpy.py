@@ -0,0 +1,602 @@
+"""
+The audio frontend in NumPy only: loading, resampling and the log-Mel spectrogram without torch,
+for processes that only prepare the model inputs. `whisper.audio` builds on this module and adds
+the torch implementations, which give the same results within float32 precision.
+"""
+
+import io
+import math
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import wave
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from subprocess import DEVNULL, PIPE, Popen, run
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .utils import exact_div
+
+# hard-coded audio hyperparameters
+SAMPLE_RATE = 16000
+N_FFT = 400
+N_MELS = 80
+HOP_LENGTH = 160
+CHUNK_LENGTH = 30
+N_SAMPLES = CHUNK_LENGTH * SAMPLE_RATE  # 480000 samples in a 30-second chunk
+N_FRAMES = exact_div(N_SAMPLES, HOP_LENGTH)  # 3000 frames in a mel spectrogram input
+
+N_SAMPLES_PER_TOKEN = HOP_LENGTH * 2  # the initial convolutions has stride 2
+FRAMES_PER_SECOND = exact_div(SAMPLE_RATE, HOP_LENGTH)  # 10ms per audio frame
+TOKENS_PER_SECOND = exact_div(SAMPLE_RATE, N_SAMPLES_PER_TOKEN)  # 20ms per audio token
+
+
+def _as_file(file: Union[str, bytes, BinaryIO]) -> Union[str, BinaryIO]:
+    """wraps the audio content given as bytes in a file-like object"""
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return io.BytesIO(file)
+    return file
+
+
+def _decode_in_process(
+    file: Union[str, BinaryIO], sr: int, chunk_size: Optional[int]
+) -> Optional[Iterator[np.ndarray]]:
+    """
+    Returns an iterator of float32 audio chunks if the file is a mono 16-bit PCM WAV, or FLAC when
+    the optional `soundfile` package is installed, at the sample rate `sr` already. Such files are
+    read directly without launching ffmpeg; None is returned for anything else, after rewinding
+    a file-like object to where it was. Streams that cannot be rewound are left to ffmpeg.
+    """
+    if isinstance(file, str):
+        position = None
+    elif file.seekable():
+        position = file.tell()
+    else:
+        return None
+
+    def rewind():
+        if position is not None:
+            file.seek(position)
+
+    try:
+        reader = wave.open(file, "rb")
+    except (wave.Error, EOFError, OSError):
+        reader = None
+        rewind()
+
+    if reader is not None:
+        params = reader.getparams()
+        if (params.nchannels, params.sampwidth, params.framerate) != (1, 2, sr):
+            reader.close()
+            rewind()
+            return None
+
+        def read_wave():
+            with reader:
+                while data := reader.readframes(chunk_size or params.nframes or 1):
+                    yield np.frombuffer(data, "<i2")
+
+        return _int16_to_float32(read_wave())
+
+    try:
+        import soundfile
+    except ImportError:
+        return None
+
+    try:
+        info = soundfile.info(file)
+    except RuntimeError:
+        info = None
+    rewind()
+    if info is None or (info.format, info.subtype, info.channels, info.samplerate) != (
+        "FLAC",
+        "PCM_16",
+        1,
+        sr,
+    ):
+        return None
+
+    blocks = soundfile.blocks(
+        file, blocksize=chunk_size or info.frames or 1, dtype="int16"
+    )
+    return _int16_to_float32(blocks)
+
+
+def _int16_to_float32(chunks: Iterator[np.ndarray]) -> Iterator[np.ndarray]:
+    for chunk in chunks:
+        chunk = chunk.astype(np.float32)
+        chunk /= 32768.0
+        yield chunk
+
+
+def _write_to_stdin(stdin: BinaryIO, file: BinaryIO, errors: List[BaseException]):
+    """
+    copies the audio content to the stdin of ffmpeg, run in a thread while stdout is read;
+    an error in reading `file` is appended to `errors` to be raised by the caller
+    """
+    try:
+        while block := file.read(1 << 16):
+            stdin.write(block)
+    except (BrokenPipeError, ValueError):
+        pass  # ffmpeg has exited or was killed; its return code tells why
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        # ffmpeg waits for the end of its input until stdin is closed
+        try:
+            stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+
+def load_audio_chunks(
+    file: Union[str, bytes, BinaryIO],
+    sr: int = SAMPLE_RATE,
+    chunk_size: int = N_SAMPLES,
+) -> Iterator[np.ndarray]:
+    """
+    Open an audio file and read it as mono waveform chunks while ffmpeg is still decoding
+
+    Parameters
+    ----------
+    file: Union[str, bytes, BinaryIO]
+        The audio file to open, or its content as bytes or a binary file-like object, which is
+        piped to ffmpeg through stdin without being written to disk. Containers that need
+        seeking to be decoded, such as MP4 with the index at the end, have to be given by path.
+
+    sr: int
+        The sample rate to resample the audio if necessary
+
+    chunk_size: int
+        The number of samples in each yielded chunk; by default, a 30-second window
+
+    Returns
+    -------
+    An iterator of NumPy arrays containing the audio waveform, in float32 dtype.
+    Every chunk has `chunk_size` samples except for the last one.
+    """
+    file = _as_file(file)
+
+    # audio that needs no down-mixing or resampling is read without a subprocess
+    if (chunks := _decode_in_process(file, sr, chunk_size)) is not None:
+        yield from chunks
+        return
+
+    # This launches a subprocess to decode audio while down-mixing
+    # and resampling as necessary.  Requires the ffmpeg CLI in PATH.
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", file if isinstance(file, str) else "pipe:0",
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "-"
+    ]
+    # fmt: on
+
+    # stderr goes to a temporary file so that a chatty ffmpeg cannot fill up the pipe
+    # and block while we are only reading from stdout
+    with tempfile.TemporaryFile() as stderr:
+        write_errors = []
+        if isinstance(file, str):
+            process, writer = Popen(cmd, stdout=PIPE, stderr=stderr), None
+        else:
+            # the content is written from another thread, so that neither pipe can fill up
+            # while ffmpeg waits for the other one to be drained
+            process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=stderr)
+            writer = threading.Thread(
+                target=_write_to_stdin,
+                args=(process.stdin, file, write_errors),
+                daemon=True,
+            )
+            writer.start()
+
+        try:
+            while True:
+                buffer = process.stdout.read(chunk_size * 2)
+                if len(buffer) < 2:
+                    break
+
+                chunk = np.frombuffer(buffer, np.int16, len(buffer) // 2)
+                chunk = chunk.astype(np.float32)
+                chunk /= 32768.0
+                yield chunk
+        finally:
+            # the consumer may stop early; make sure ffmpeg does not linger around
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            returncode = process.wait()
+            if writer is not None:
+                writer.join()
+
+        if write_errors:
+            raise write_errors[0]
+        if returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"Failed to load audio: {stderr.read().decode()}")
+
+
+def _probe(file: str) -> Tuple[Optional[float], Optional[str]]:
+    """
+    Returns the duration of a media file in seconds and the codec of its first audio stream,
+    as reported by ffmpeg, if known
+    """
+    cmd = ["ffmpeg", "-nostdin", "-hide_banner", "-i", file]
+    # without an output file ffmpeg exits with an error after printing the input information
+    output = run(cmd, stdout=DEVNULL, stderr=PIPE).stderr.decode(errors="replace")
+    duration = codec = None
+    if match := re.search(r"Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)", output):
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    if match := re.search(r"Stream #.*?: Audio: (\w+)", output):
+        codec = match.group(1)
+    return duration, codec
+
+
+def _seeks_exactly(codec: Optional[str]) -> bool:
+    """
+    Whether ffmpeg decodes the same samples after an input-side seek as without one. Lossy codecs
+    such as Vorbis and AAC start decoding at a packet boundary and have priming samples, so that
+    their ranges come out shifted or cut short; those not verified are decoded in one range.
+    """
+    return codec is not None and (codec == "flac" or codec.startswith("pcm_"))
+
+
+def _decode_slice(
+    file: str,
+    sr: int,
+    out: np.ndarray,
+    skip: int,
+    seek: float,
+    duration: Optional[float],
+) -> Tuple[int, List[np.ndarray]]:
+    """
+    Decodes `duration` seconds of audio from `seek` seconds into `out`, after discarding the first
+    `skip` samples. Returns the number of samples written and, if `out` was filled up, the rest of
+    the decoded samples.
+    """
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-ss", f"{seek:.6f}",
+        "-i", file,
+        *(["-t", f"{duration:.6f}"] if duration is not None else []),
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "-"
+    ]
+    # fmt: on
+
+    written, overflow = 0, []
+    with tempfile.TemporaryFile() as stderr:
+        process = Popen(cmd, stdout=PIPE, stderr=stderr)
+        try:
+            while len(buffer := process.stdout.read(1 << 20)) >= 2:
+                samples = np.frombuffer(buffer, np.int16, len(buffer) // 2)
+                dropped = min(skip, len(samples))
+                samples, skip = samples[dropped:], skip - dropped
+
+                n = min(len(samples), len(out) - written)
+                out[written : written + n] = samples[:n]
+                out[written : written + n] /= 32768.0
+                written += n
+                if n < len(samples):
+                    overflow.append(samples[n:].astype(np.float32) / 32768.0)
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            returncode = process.wait()
+
+        if returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"Failed to load audio: {stderr.read().decode()}")
+
+    return written, overflow
+
+
+def _load_audio_parallel(
+    file: str, sr: int, num_workers: int, duration: float
+) -> np.ndarray:
+    """
+    Decodes disjoint time ranges of the file in `num_workers` ffmpeg processes at once, each into
+    its own range of one preallocated buffer. Every range starts decoding a second early and
+    discards those samples, so that the decoder and resampler are warmed up at the boundary.
+    """
+    n_samples = math.ceil(duration * sr)
+    n_slices = max(1, min(num_workers, n_samples // (60 * sr)))  # a minute or more each
+
+    # ranges start at whole seconds, where the samples of any integer input sample rate line up
+    # with the output samples; otherwise the seek lands between two output samples
+    slice_size = -(-n_samples // (n_slices * sr)) * sr
+    margin = sr
+
+    # the duration in the container header may be a little off; the last range is decoded
+    # to the end of the file, into a second of headroom and then into `overflow` if needed
+    audio = np.empty(n_samples + sr, dtype=np.float32)
+    slices = []
+    for i in range(n_slices):
+        start = i * slice_size
+        end = start + slice_size if i < n_slices - 1 else len(audio)
+        seek = max(0, start - margin)
+        seconds = (end - seek + margin) / sr if i < n_slices - 1 else None
+        slices.append((start, end, seek, seconds))
+
+    with ThreadPoolExecutor(n_slices) as pool:
+        futures = [
+            pool.submit(
+                _decode_slice,
+                file,
+                sr,
+                audio[start:end],
+                start - seek,
+                seek / sr,
+                seconds,
+            )
+            for start, end, seek, seconds in slices
+        ]
+        results = [future.result() for future in futures]
+
+    length = 0
+    for (start, end, _, _), (written, _) in zip(slices, results):
+        audio[start + written : end] = 0  # the file ended earlier than its header says
+        if written > 0:
+            length = start + written
+
+    overflow = results[-1][1]
+    if overflow:
+        return np.concatenate([audio[:length], *overflow])
+    return audio[:length]
+
+
+def load_audio(
+    file: Union[str, bytes, BinaryIO], sr: int = SAMPLE_RATE, num_workers: int = 1
+):
+    """
+    Open an audio file and read as mono waveform, resampling as necessary
+
+    Parameters
+    ----------
+    file: Union[str, bytes, BinaryIO]
+        The audio file to open, or its content as bytes or a binary file-like object;
+        see `load_audio_chunks()`
+
+    sr: int
+        The sample rate to resample the audio if necessary
+
+    num_workers: int
+        The number of ffmpeg processes decoding disjoint time ranges of a long audio file at once,
+        each into its own part of the output; ranges are at least a minute long. Only PCM and
+        FLAC audio is decoded in parallel, as other codecs cannot be seeked to the exact sample;
+        they, bytes and file-like objects are always decoded by a single process
+
+    Returns
+    -------
+    A NumPy array containing the audio waveform, in float32 dtype.
+    """
+    file = _as_file(file)
+
+    # audio that needs no down-mixing or resampling is read in one go without a subprocess
+    if (chunks := _decode_in_process(file, sr, chunk_size=None)) is not None:
+        chunks = list(chunks)
+    elif (
+        num_workers > 1
+        and isinstance(file, str)
+        and (probe := _probe(file))[0] is not None
+        and _seeks_exactly(probe[1])
+    ):
+        return _load_audio_parallel(file, sr, num_workers, probe[0])
+    else:
+        # reading the decoded stream in chunks avoids holding the raw ffmpeg output,
+        # its int16 view and the float32 copy in memory all at the same time
+        chunks = list(load_audio_chunks(file, sr))
+
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=np.float32)
+    if len(chunks) == 1:
+        return chunks[0]
+
+    return np.concatenate(chunks)
+
+
+@lru_cache(maxsize=None)
+def polyphase_filters(up: int, down: int) -> Tuple[np.ndarray, int]:
+    """
+    Build the polyphase decomposition of the anti-aliasing filter for resampling by `up / down`,
+    as a (up, n_taps) array with the taps of each phase in the order they meet the input samples,
+    along with the half-length of the prototype filter. The prototype is a Kaiser-windowed sinc,
+    the same as the default of `scipy.signal.resample_poly`.
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    k = np.arange(-half_len, half_len + 1)
+    taps = np.sinc(k / max_rate) * np.kaiser(2 * half_len + 1, 5.0)
+    taps *= up / taps.sum()
+
+    n_taps = 2 * half_len // up + 1
+    index = 2 * half_len - np.arange(up)[:, None] - up * np.arange(n_taps)[None, :]
+    filters = np.where(index >= 0, taps[np.maximum(index, 0)], 0.0)
+    return filters.astype(np.float32), half_len
+
+
+def resample(
+    audio: np.ndarray, orig_sr: int, target_sr: int = SAMPLE_RATE
+) -> np.ndarray:
+    """
+    Resample a mono waveform in memory, using a polyphase filter bank cached per rate ratio
+
+    Parameters
+    ----------
+    audio: np.ndarray, shape = (n_samples,)
+        A NumPy array containing the audio waveform
+
+    orig_sr: int
+        The sample rate of the given audio
+
+    target_sr: int
+        The sample rate to resample the audio to
+
+    Returns
+    -------
+    A NumPy array containing the resampled waveform in float32
+    """
+    if orig_sr == target_sr:
+        return audio
+
+    x = np.asarray(audio).astype(np.float32, copy=False)
+
+    gcd = math.gcd(orig_sr, target_sr)
+    up, down = target_sr // gcd, orig_sr // gcd
+    filters, half_len = polyphase_filters(up, down)
+    n_taps = filters.shape[-1]
+
+    # output n is the dot product of the filter phase (half_len - n * down) % up
+    # with the input samples starting at (n * down - half_len + phase) // up
+    n_out = -(-x.shape[-1] * up // down)
+    pad = half_len // up + n_taps + down // up + 2
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(x, pad), n_taps)
+
+    output = np.empty(n_out, dtype=np.float32)
+    for r in range(min(up, n_out)):
+        # outputs r, r + up, r + 2 * up, ... share the same phase
+        t = r * down
+        phase = (half_len - t) % up
+        start = (t - half_len + phase) // up + pad
+        count = len(range(r, n_out, up))
+        output[r::up] = windows[start::down][:count] @ filters[phase]
+
+    return output
+
+
+@lru_cache(maxsize=None)
+def mel_filters(n_mels: int = N_MELS) -> np.ndarray:
+    """
+    load the mel filterbank matrix for projecting STFT into a Mel spectrogram, as a read-only
+    float32 array of shape (n_mels, N_FFT // 2 + 1); see `whisper.audio.mel_filters`
+    """
+    assert n_mels == 80, f"Unsupported n_mels: {n_mels}"
+    with np.load(
+        os.path.join(os.path.dirname(__file__), "assets", "mel_filters.npz")
+    ) as f:
+        filters = f[f"mel_{n_mels}"]
+    filters.flags.writeable = False
+    return filters
+
+
+@lru_cache(maxsize=None)
+def hann_window() -> np.ndarray:
+    """the periodic Hann window, the same as `torch.hann_window(N_FFT)`"""
+    window = np.hanning(N_FFT + 1)[:-1].astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+def log_mel_spectrogram(
+    audio: Union[str, np.ndarray],
+    n_mels: int = N_MELS,
+    padding: int = 0,
+    sample_rate: int = SAMPLE_RATE,
+    block_frames: int = N_FRAMES,
+) -> np.ndarray:
+    """
+    Compute the log-Mel spectrogram of the audio with NumPy's real FFT
+
+    Parameters
+    ----------
+    audio: Union[str, np.ndarray], shape = (*)
+        The path to audio or a NumPy array containing the audio waveform
+
+    n_mels: int
+        The number of Mel-frequency filters, only 80 is supported
+
+    padding: int
+        Number of zero samples to pad to the right
+
+    sample_rate: int
+        The sample rate of the given NumPy array, which is resampled to 16 kHz if it differs;
+        ignored for paths, which are decoded at 16 kHz
+
+    block_frames: int
+        The number of frames transformed at a time, which bounds the memory used for the
+        overlapping STFT frames on long audio
+
+    Returns
+    -------
+    np.ndarray, shape = (80, n_frames)
+        A float32 array that contains the Mel spectrogram, equal to that of
+        `whisper.audio.log_mel_spectrogram` within float32 precision
+    """
+    if isinstance(audio, str):
+        audio = load_audio(audio)
+    elif sample_rate != SAMPLE_RATE:
+        audio = resample(audio, sample_rate)
+
+    audio = np.asarray(audio, dtype=np.float32)
+    if padding > 0:
+        audio = np.pad(audio, (0, padding))
+
+    # the same framing as torch.stft(center=True): reflect-pad half a window on both sides,
+    # then drop the last frame as `whisper.audio.log_mel_spectrogram` does
+    audio = np.pad(audio, N_FFT // 2, mode="reflect")
+    frames = np.lib.stride_tricks.sliding_window_view(audio, N_FFT)[::HOP_LENGTH]
+    n_frames = frames.shape[0] - 1
+
+    window = hann_window()
+    filters = mel_filters(n_mels)
+    mel_spec = np.empty((n_mels, n_frames), dtype=np.float32)
+    for start in range(0, n_frames, block_frames):
+        end = min(start + block_frames, n_frames)
+        stft = np.fft.rfft(frames[start:end] * window, axis=-1)
+        magnitudes = stft.real**2 + stft.imag**2
+        mel_spec[:, start:end] = filters @ magnitudes.T.astype(np.float32)
+
+    log_spec = np.log10(np.maximum(mel_spec, 1e-10))
+    log_spec = np.maximum(log_spec, log_spec.max(initial=-np.inf) - 8.0)
+    log_spec = (log_spec + 4.0) / 4.0
+    return log_spec
+
+
+def prefetch_log_mel_spectrograms(
+    files: Iterable[str], num_workers: int, padding: int = 0
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    Compute the log-Mel spectrograms of audio files in a pool of `num_workers` processes and
+    yield them in order, as (file, mel) pairs, while the caller is busy with the previous ones.
+    At most `num_workers` files are decoded ahead of the one being consumed, so that no more than
+    that many spectrograms are held in memory however long the list of files is. An error in
+    decoding a file is raised when that file is reached.
+    """
+    # spawn rather than fork: the parent has usually loaded torch and started its thread pools
+    context = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(num_workers, mp_context=context)
+    pending = deque()
+    try:
+        for file in files:
+            future = pool.submit(log_mel_spectrogram, file, padding=padding)
+            pending.append((file, future))
+            if len(pending) > num_workers:
+                file, future = pending.popleft()
+                yield file, future.result()
+
+        while pending:
+            file, future = pending.popleft()
+            yield file, future.result()
+    finally:
+        # as `shutdown(cancel_futures=True)`, which needs Python 3.9
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown()
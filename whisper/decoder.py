@@ -8,15 +8,20 @@ import torch
 import torch.nn.functional as F
 from torch import Tensor, nn
 
+from .encoder import LayerNorm, fuse_linears, without_affine
 from .decoding import decode as decode_function
 from .decoding import detect_language as detect_language_function
 from .transcribe import transcribe as transcribe_function
 from timeit import default_timer as timer
 
+totalCrossKVComputed = 0
+totalCrossKVReused = 0
+
 def fuse_query_and_qk_scale(state_dict, prefix, local_metadata, strict,
                             missing_keys, unexpected_keys, error_msgs):
     for k in state_dict:
-        if all(substr in k for substr in ['query']):
+        # a quantized query layer saves its already fused weights packed, under other names
+        if k.endswith(('query.weight', 'query.bias')):
             state_dict[k] = state_dict[k] * 0.125 # qk_scale = 1/(64^0.5)
 
 # use two-levels split to reduce edge degree in graph
@@ -39,8 +44,16 @@ class MultiHeadAttention(nn.Module):
         self.key = nn.Linear(n_state, n_state, bias=False)
         self.value = nn.Linear(n_state, n_state)
         self.out = nn.Linear(n_state, n_state)
+        # query, key and value in one GEMM, set by `fuse_qkv()`
+        self.qkv = None
+        self.n_state = n_state
         self._register_load_state_dict_pre_hook(fuse_query_and_qk_scale)
 
+    def fuse_qkv(self, ln: Optional[nn.LayerNorm] = None):
+        # after loading, so the query is already scaled by `fuse_query_and_qk_scale`
+        self.qkv = fuse_linears([self.query, self.key, self.value], ln)
+        self.query = self.key = self.value = None
+
     def forward(
         self,
         x: Tensor,
@@ -48,9 +61,12 @@ class MultiHeadAttention(nn.Module):
         cache_k: Optional[Tensor] = None,
         cache_v: Optional[Tensor] = None,
     ):
-        q = self.query(x)
-        k = self.key(x)
-        v = self.value(x)
+        if self.qkv is not None:
+            q, k, v = self.qkv(x).split(self.n_state, dim=-1)
+        else:
+            q = self.query(x)
+            k = self.key(x)
+            v = self.value(x)
 
         new_k = k
         new_v = v
@@ -84,6 +100,9 @@ class CrossMultiHeadAttention(MultiHeadAttention):
         q = q.view(*q.shape[:2], self.n_head, -1).permute(0, 2, 1, 3)
 
         qk = q @ k
+        if qk.dtype == torch.bfloat16:
+            # the self-attention gets this from adding the float32 mask
+            qk = qk.float()
 
         w = qk.softmax(dim=-1).to(q.dtype)
         wv = (w @ v).permute(0, 2, 1, 3).flatten(start_dim=2)
@@ -96,18 +115,33 @@ class ResidualAttentionBlock(nn.Module):
 
         self.n_state = n_state
         self.attn = MultiHeadAttention(n_state, n_head)
-        self.attn_ln = nn.LayerNorm(n_state)
+        self.attn_ln = LayerNorm(n_state)
 
         self.cross_attn = (
             CrossMultiHeadAttention(n_state, n_head) if cross_attention else None
         )
-        self.cross_attn_ln = nn.LayerNorm(n_state) if cross_attention else None
+        self.cross_attn_ln = LayerNorm(n_state) if cross_attention else None
 
         n_mlp = n_state * 4
         self.mlp = nn.Sequential(
             nn.Linear(n_state, n_mlp), nn.GELU(), nn.Linear(n_mlp, n_state)
         )
-        self.mlp_ln = nn.LayerNorm(n_state)
+        self.mlp_ln = LayerNorm(n_state)
+
+    def fuse(self, fold_layer_norm: bool = True):
+        """Fuse the query, key and value projections, folding in the LayerNorms if asked to"""
+        if not fold_layer_norm:
+            self.attn.fuse_qkv()
+            return
+
+        self.attn.fuse_qkv(self.attn_ln)
+        self.attn_ln = without_affine(self.attn_ln)
+        if self.cross_attn:
+            # key and value read the audio features, only the query follows cross_attn_ln
+            self.cross_attn.query = fuse_linears([self.cross_attn.query], self.cross_attn_ln)
+            self.cross_attn_ln = without_affine(self.cross_attn_ln)
+        self.mlp[0] = fuse_linears([self.mlp[0]], self.mlp_ln)
+        self.mlp_ln = without_affine(self.mlp_ln)
 
     def forward(
         self,
@@ -144,7 +178,7 @@ class TextDecoder(nn.Module):
                     for _ in range(n_layer)
                 ]
             )
-        self.ln = nn.LayerNorm(n_state)
+        self.ln = LayerNorm(n_state)
         self.n_vocab = n_vocab
         self.n_state = n_state
         self.n_layer = n_layer
@@ -154,7 +188,11 @@ class TextDecoder(nn.Module):
         self.coremlDecoder = None
         self.coremlDecoder256 = None
         self.coremlCrossKV = None
+        self.onnx = None
         self.cross_kv_caches = None
+        self.cross_kv_source = None
+        # int8 copy of the token embedding for the logits, set by `Whisper.quantize_int8()`
+        self.token_projection = None
         self.use_coreml = use_coreml
         self.modelName = modelName
 
@@ -170,21 +208,44 @@ class TextDecoder(nn.Module):
         self.register_buffer("alignment_heads", all_heads.to_sparse(), persistent=False)
 
     def crossKVCaches(self, xa: Tensor):
+        global totalCrossKVComputed
+        global totalCrossKVReused
+
         if self.use_coreml:
             self.coreml.loadCrossKV()
             return self.coreml.crossKVPredict()
 
-        cross_k_caches = []
-        cross_v_caches = []
-        for block in self.blocks:
-            k = block.cross_attn.key(xa)
-            k = k.view(*k.shape[:2], self.n_head, 64).permute(0, 2, 3, 1)
-            cross_k_caches.append(k) #[1, 12, 64, 1500]
-
-            v = block.cross_attn.value(xa)
-            v = v.view(*v.shape[:2], self.n_head, 64).permute(0, 2, 1, 3)
-            cross_v_caches.append(v) #[1, 12, 1500, 64]
-        return torch.cat(cross_k_caches, dim=0), torch.cat(cross_v_caches, dim=0)
+        # fallback attempts and word timestamps decode the same window again, usually through a
+        # different view of the same audio_features, so compare the memory rather than the object.
+        # holding xa keeps its memory from being reused by another window while it is cached
+        key = (xa.data_ptr(), xa.shape, xa.stride(), xa.dtype, xa.device, xa._version)
+        if torch.jit.is_tracing():
+            # a conversion script traces this, possibly more than once with the same example
+            key = None
+        elif self.cross_kv_source is not None and self.cross_kv_source[0] == key:
+            totalCrossKVReused += 1
+            return self.cross_kv_source[2], self.cross_kv_source[3]
+
+        if self.onnx is not None:
+            cross_k_caches, cross_v_caches = self.onnx.crossKVPredict(xa)
+        else:
+            cross_k_caches = []
+            cross_v_caches = []
+            for block in self.blocks:
+                k = block.cross_attn.key(xa)
+                k = k.view(*k.shape[:2], self.n_head, 64).permute(0, 2, 3, 1)
+                cross_k_caches.append(k) #[1, 12, 64, 1500]
+
+                v = block.cross_attn.value(xa)
+                v = v.view(*v.shape[:2], self.n_head, 64).permute(0, 2, 1, 3)
+                cross_v_caches.append(v) #[1, 12, 1500, 64]
+            cross_k_caches = torch.cat(cross_k_caches, dim=0)
+            cross_v_caches = torch.cat(cross_v_caches, dim=0)
+
+        totalCrossKVComputed += 1
+        if key is not None:
+            self.cross_kv_source = (key, xa, cross_k_caches, cross_v_caches)
+        return cross_k_caches, cross_v_caches
 
     def forward(self, x: Tensor,
                 xa: Optional[Tensor],
@@ -211,7 +272,7 @@ class TextDecoder(nn.Module):
             max_n_ctx = self.max_n_ctx_for_1st
             qk_mask = (torch.ones(max_n_ctx, max_n_ctx) * -np.inf).triu_(1)
             qk_mask[:, n_ctx:] = -np.inf
-            x = torch.cat([x, torch.zeros(n_batch, max_n_ctx-n_ctx, self.n_state)], dim=1)
+            x = torch.cat([x, torch.zeros(n_batch, max_n_ctx-n_ctx, self.n_state, dtype=x.dtype)], dim=1)
 
             # predict beam by beam for reuse decoder256 coreml model for bs=1 and bs=5
             x_bs = x.split(1)
@@ -235,9 +296,12 @@ class TextDecoder(nn.Module):
 
             x = x.split(n_ctx, dim=1)[0]
             cross_qks = cross_qks.split(n_ctx, dim=1)[0]
-            logits = (
-                x @ torch.transpose(self.token_embedding.weight.to(x.dtype), 0, 1)
-            ).float()
+            if self.token_projection is not None:
+                logits = self.token_projection(x).float()
+            else:
+                logits = (
+                    x @ torch.transpose(self.token_embedding.weight.to(x.dtype), 0, 1)
+                ).float()
         else: # decoder1
             qk_mask = torch.cat([torch.zeros((1,text_offset)),
                                  torch.ones((1, 448-text_offset)) * -np.inf,
@@ -278,11 +342,20 @@ class TextDecoder(nn.Module):
                 self.coreml.loadDecoder256()
                 return self.coreml.decoder256Predict(x, qk_mask, beam_idx)
 
+        # ONNX Runtime part; a step of a single beam is faster in PyTorch, which shares the caches
+        if self.onnx is not None:
+            if masked_kv_caches is not None and x.shape[1] == 1:
+                if x.shape[0] > 1:
+                    return self.onnx.decoder1Predict(x, qk_mask, masked_kv_caches,
+                                                     cross_k_caches, cross_v_caches)
+            else:
+                return self.onnx.decoder256Predict(x, qk_mask, cross_k_caches, cross_v_caches)
+
         if x.shape[0] == 1 and x.shape[1] == 1:
             # nn.Linear speed up trick
             # mlp([1,1,768]) is 25% slower than mlp([1, 2~100, 768]) on ANE
             # I don't know why... note: this also makes whisper on cpu 10.5s -> 14.3s
-            x = torch.cat([x, torch.zeros((1, 1, self.n_state))], dim=1)
+            x = torch.cat([x, torch.zeros((1, 1, self.n_state), dtype=x.dtype)], dim=1)
 
         cross_head_weights = []
         new_masked_kv_caches = []
@@ -316,8 +389,11 @@ class TextDecoder(nn.Module):
         x = self.ln(x)
 
         if qk_mask.shape[0] == 1: # decoder1
-            splits = self.token_embedding.weight.split(12288, dim=0)
-            logits = torch.cat([x @ split.transpose(0,1) for split in splits], dim=2)
+            if self.token_projection is not None:
+                logits = self.token_projection(x)
+            else:
+                splits = self.token_embedding.weight.split(12288, dim=0)
+                logits = torch.cat([x @ split.transpose(0,1) for split in splits], dim=2)
 
             if x.shape[0] == 1:
                 # end Linear speed up trick
@@ -328,3 +404,8 @@ class TextDecoder(nn.Module):
         else: # decoder256
             return x, cross_head_weights, new_masked_kv_caches
 
+def showCrossKVCaches():
+    print("  --- Cross-attention KV --")
+    print(f"  computed           {totalCrossKVComputed}")
+    print(f"  reused             {totalCrossKVReused}")
+    print("  -------------------------")
@@ -18,12 +18,17 @@ from timeit import default_timer as timer
 
 @torch.no_grad()
 def detect_language(
-    model: "Whisper", mel: Tensor, tokenizer: Tokenizer = None
+    model: "Whisper",
+    mel: Optional[Tensor],
+    tokenizer: Tokenizer = None,
+    audio_features: Optional[Tensor] = None,
 ) -> Tuple[Tensor, List[dict]]:
     """
     Detect the spoken language in the audio, and return them as list of strings, along with the ids
     of the most probable language tokens and the probability distribution over all language tokens.
     This is performed outside the main decode loop in order to not interfere with kv-caching.
+    The encoder output can be given as `audio_features`, possibly of a short last window, in
+    which case `mel` is not used.
 
     Returns
     -------
@@ -42,12 +47,18 @@ def detect_language(
             "This model doesn't have language tokens so it can't perform lang id"
         )
 
+    if audio_features is not None:
+        mel = audio_features
+
     single = mel.ndim == 2
     if single:
         mel = mel.unsqueeze(0)
 
     # skip encoder forward pass if already-encoded audio features were given
-    if mel.shape[-2:] != (model.dims.n_audio_ctx, model.dims.n_audio_state):
+    if audio_features is None and mel.shape[-2:] != (
+        model.dims.n_audio_ctx,
+        model.dims.n_audio_state,
+    ):
         mel = model.encoder(mel)
 
     # forward pass using a single token, startoftranscript
@@ -171,7 +182,7 @@ class PyTorchInference(Inference):
                                448 - self.model.decoder.max_n_ctx_for_1st,
                                new_mkv.shape[3])
                 self.model.masked_kv_caches = torch.cat([new_mkv,
-                                                         torch.zeros(zeros_shape)], dim=2)
+                                                         torch.zeros(zeros_shape, dtype=new_mkv.dtype)], dim=2)
             else:
                 from_offset = self.model.text_offset
                 to_offset = self.model.text_offset + n_ctx
@@ -187,8 +198,14 @@ class PyTorchInference(Inference):
     def rearrange_kv_cache(self, source_indices):
         if not self.model.use_coreml: # only after decoder256
             if source_indices != list(range(len(source_indices))):
-                # numpy is faster than torch 26ms -> 16ms
                 text_offset = self.model.text_offset
+                if self.model.masked_kv_caches.dtype == torch.bfloat16:
+                    # numpy has no bfloat16
+                    caches = self.model.masked_kv_caches
+                    caches[:, :, :text_offset] = caches[:, source_indices, :text_offset]
+                    return
+
+                # numpy is faster than torch 26ms -> 16ms
                 np_array = self.model.masked_kv_caches.numpy()
                 np_array_part = np_array[:,:,:text_offset]
                 for i in range(0, self.n_text_layer * 2):
@@ -666,6 +683,8 @@ class DecodingTask:
     def _get_audio_features(self, mel: Tensor):
         if self.options.fp16:
             mel = mel.half()
+        elif self.model.dtype == torch.bfloat16:
+            mel = mel.bfloat16()
 
         if mel.shape[-2:] == (
             self.model.dims.n_audio_ctx,
@@ -677,7 +696,7 @@ class DecodingTask:
             audio_features = self.model.encoder(mel)
 
         if audio_features.dtype != (
-            torch.float16 if self.options.fp16 else torch.float32
+            torch.float16 if self.options.fp16 else self.model.dtype
         ):
             return TypeError(
                 f"audio_features has an incorrect dtype: {audio_features.dtype}"
@@ -691,7 +710,7 @@ class DecodingTask:
 
         if self.options.language is None or self.options.task == "lang_id":
             lang_tokens, lang_probs = self.model.detect_language(
-                audio_features, self.tokenizer
+                None, self.tokenizer, audio_features=audio_features
             )
             languages = [max(probs, key=probs.get) for probs in lang_probs]
             if self.options.language is None:
@@ -732,12 +751,15 @@ class DecodingTask:
         return tokens, sum_logprobs, no_speech_probs
 
     @torch.no_grad()
-    def run(self, mel: Tensor) -> List[DecodingResult]:
+    def run(
+        self, mel: Tensor, audio_features: Optional[Tensor] = None
+    ) -> List[DecodingResult]:
         self.decoder.reset()
         tokenizer: Tokenizer = self.tokenizer
         n_audio: int = mel.shape[0]
 
-        audio_features: Tensor = self._get_audio_features(mel)  # encoder forward pass
+        if audio_features is None:
+            audio_features = self._get_audio_features(mel)  # encoder forward pass
         tokens: Tensor = torch.tensor([self.initial_tokens]).repeat(n_audio, 1)
 
         # detect language if requested, overwriting the language token
@@ -816,6 +838,7 @@ def decode(
     model: "Whisper",
     mel: Tensor,
     options: DecodingOptions = DecodingOptions(),
+    audio_features: Optional[Tensor] = None,
     **kwargs,
 ) -> Union[DecodingResult, List[DecodingResult]]:
     """
@@ -832,6 +855,10 @@ def decode(
     options: DecodingOptions
         A dataclass that contains all necessary options for decoding 30-second segments
 
+    audio_features: Optional[torch.Tensor], shape = (n_ctx, n_state) or (*, n_ctx, n_state)
+        The encoder output of `mel` from an earlier decoding, possibly of a short last window,
+        to skip the encoder forward pass
+
     Returns
     -------
     result: Union[DecodingResult, List[DecodingResult]]
@@ -839,10 +866,12 @@ def decode(
     """
     if single := mel.ndim == 2:
         mel = mel.unsqueeze(0)
+        if audio_features is not None:
+            audio_features = audio_features.unsqueeze(0)
 
     if kwargs:
         options = replace(options, **kwargs)
 
-    result = DecodingTask(model, options).run(mel)
+    result = DecodingTask(model, options).run(mel, audio_features)
 
     return result[0] if single else result
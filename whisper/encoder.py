@@ -1,3 +1,5 @@
+import os
+import warnings
 from typing import Dict, Iterable, Optional
 
 import numpy as np
@@ -15,12 +17,53 @@ def sinusoids(length, channels, max_timescale=10000):
     scaled_time = torch.arange(length)[:, np.newaxis] * inv_timescales[np.newaxis, :]
     return torch.cat([torch.sin(scaled_time), torch.cos(scaled_time)], dim=1)
 
+class LayerNorm(nn.LayerNorm):
+    # normalizes in float32 when the rest of the model runs in bfloat16, see `Whisper.to_bf16()`
+    def forward(self, x: Tensor) -> Tensor:
+        dtype = self.weight.dtype if self.weight is not None else torch.float32
+        if x.dtype == dtype:
+            return super().forward(x)
+        return super().forward(x.float()).type(x.dtype)
+
+def fuse_linears(linears: Iterable[nn.Linear], ln: Optional[nn.LayerNorm] = None) -> nn.Linear:
+    """
+    Concatenate nn.Linear layers reading the same input into one, and fold the affine parameters
+    of the LayerNorm `ln` in front of them into its weight and bias:
+    W (n * g + b) + c = (W * g) n + (W b + c)
+    """
+    linears = list(linears)
+    weight = torch.cat([linear.weight.double() for linear in linears])
+    bias = torch.cat([
+        linear.bias.double() if linear.bias is not None
+        else weight.new_zeros(linear.out_features) for linear in linears
+    ])
+    if ln is not None:
+        bias = bias + weight @ ln.bias.double()
+        weight = weight * ln.weight.double()
+
+    dtype = linears[0].weight.dtype
+    fused = nn.Linear(weight.shape[1], weight.shape[0], device=weight.device, dtype=dtype)
+    with torch.no_grad():
+        fused.weight.copy_(weight)
+        fused.bias.copy_(bias)
+    return fused
+
+def without_affine(ln: nn.LayerNorm) -> LayerNorm:
+    """The LayerNorm `ln` once its affine parameters are folded by `fuse_linears()`"""
+    return LayerNorm(ln.normalized_shape, eps=ln.eps, elementwise_affine=False)
+
 # https://github.com/apple/coremltools/issues/1900
 def speedup_conversion_workaround(x: Tensor, n_state: int):
+    # only changes how coremltools compiles the traced graph; the identity in PyTorch
     # (1, 1500, 384) -> (1, 1501, 384) -> (1, 1500, 384)
-    return torch.cat([x, torch.empty(1, 1, n_state)], dim=1).split(1500, dim=1)[0]
+    n_batch, n_ctx, _ = x.shape
+    padding = torch.empty(n_batch, 1, n_state, dtype=x.dtype, device=x.device)
+    return torch.cat([x, padding], dim=1).split(n_ctx, dim=1)[0]
 
 class MultiHeadAttention(nn.Module):
+    # computes all heads at once with scaled_dot_product_attention, see `looped_attention()`
+    use_sdpa = True
+
     def __init__(self, n_state: int, n_head: int):
         super().__init__()
         self.n_head = n_head
@@ -32,11 +75,27 @@ class MultiHeadAttention(nn.Module):
         self.key = nn.Linear(n_state, n_state, bias=False)
         self.value = nn.Linear(n_state, n_state)
         self.out = nn.Linear(n_state, n_state)
+        # query, key and value in one GEMM, set by `fuse_qkv()`
+        self.qkv = None
+
+    def fuse_qkv(self, ln: Optional[nn.LayerNorm] = None):
+        self.qkv = fuse_linears([self.query, self.key, self.value], ln)
+        self.query = self.key = self.value = None
+
+    def project(self, x: Tensor):
+        if self.qkv is not None:
+            return self.qkv(x).split(self.n_state, dim=-1)
+        return self.query(x), self.key(x), self.value(x)
 
     def forward(self, x: Tensor):
-        q = self.query(x)
-        k = self.key(x) * self.qk_scale
-        v = self.value(x)
+        if self.use_sdpa:
+            return self.out(self.batched_attention(x))
+        return self.out(self.looped_attention(x))
+
+    # the layout the CoreML models are converted with, one head at a time
+    def looped_attention(self, x: Tensor):
+        q, k, v = self.project(x)
+        k = k * self.qk_scale
 
         # (1, 1500, 384) -> (1, 384, 1, 1500)
         q = q.transpose(1, 2).unsqueeze(2)
@@ -54,27 +113,102 @@ class MultiHeadAttention(nn.Module):
             mh_wv.append(torch.einsum('bkhq,bchk->bchq', w, mh_v[h]))
 
         # (1, 384, 1, 1500) -> (1, 1500, 384)
-        wv = torch.cat(mh_wv, dim=1).squeeze(2).transpose(1,2)
+        return torch.cat(mh_wv, dim=1).squeeze(2).transpose(1,2)
+
+    def batched_attention(self, x: Tensor):
+        # (n_batch, 1500, 384) -> (n_batch, n_head, 1500, 64)
+        n_batch, n_ctx, _ = x.shape
+        q, k, v = [
+            t.view(n_batch, n_ctx, self.n_head, -1).transpose(1, 2) for t in self.project(x)
+        ]
+        wv = self.attend(q, k, v)
 
-        return self.out(wv)
+        # (n_batch, n_head, 1500, 64) -> (n_batch, 1500, 384)
+        return wv.transpose(1, 2).reshape(n_batch, n_ctx, -1)
+
+    def attend(self, q: Tensor, k: Tensor, v: Tensor):
+        if hasattr(F, "scaled_dot_product_attention"):
+            return F.scaled_dot_product_attention(q, k, v)
+        w = (q @ k.transpose(-1, -2) * self.qk_scale).float().softmax(dim=-1)
+        return w.to(q.dtype) @ v
+
+    def add_chunked(self, x: Tensor, residual: Tensor, chunk_frames: int):
+        """
+        Add the attention output for `x` to `residual` in place, `chunk_frames` queries at a
+        time against all the keys, so that at most (n_head, chunk_frames, n_ctx) attention
+        weights and (chunk_frames, n_state) outputs exist at once
+        """
+        n_batch, n_ctx, _ = x.shape
+        q, k, v = [
+            t.view(n_batch, n_ctx, self.n_head, -1).transpose(1, 2) for t in self.project(x)
+        ]
+        for start in range(0, n_ctx, chunk_frames):
+            wv = self.attend(q[:, :, start : start + chunk_frames], k, v)
+            wv = wv.transpose(1, 2).reshape(n_batch, -1, self.n_state)
+            residual[:, start : start + chunk_frames] += self.out(wv)
 
 class ResidualAttentionBlock(nn.Module):
     def __init__(self, n_state: int, n_head: int, cross_attention: bool = False):
         super().__init__()
 
         self.attn = MultiHeadAttention(n_state, n_head)
-        self.attn_ln = nn.LayerNorm(n_state, eps=1e-7)
+        self.attn_ln = LayerNorm(n_state, eps=1e-7)
 
         n_mlp = n_state * 4
         self.mlp = nn.Sequential(
             nn.Linear(n_state, n_mlp), nn.GELU(), nn.Linear(n_mlp, n_state)
         )
-        self.mlp_ln = nn.LayerNorm(n_state, eps=1e-7)
+        self.mlp_ln = LayerNorm(n_state, eps=1e-7)
         self.n_state = n_state
+        # frames per chunk of the low-memory mode, set by `AudioEncoder.limit_memory()`
+        self.chunk_frames = None
+
+    def fuse(self, fold_layer_norm: bool = True):
+        """Fuse the query, key and value projections, folding in the LayerNorms if asked to"""
+        if not fold_layer_norm:
+            self.attn.fuse_qkv()
+            return
+
+        self.attn.fuse_qkv(self.attn_ln)
+        self.attn_ln = without_affine(self.attn_ln)
+        self.mlp[0] = fuse_linears([self.mlp[0]], self.mlp_ln)
+        self.mlp_ln = without_affine(self.mlp_ln)
 
     def forward(self, x: Tensor):
-        x = speedup_conversion_workaround(x, self.n_state)
+        if self.chunk_frames is not None:
+            return self.forward_chunked(x)
+
         x = x + self.attn(self.attn_ln(x))
+        x = x + self.mlp(self.mlp_ln(x))
+        return x
+
+    def forward_chunked(self, x: Tensor):
+        # updates x in place; the residual stream is the one full-size activation kept across
+        # the blocks, next to the normalized input and the q, k and v of the attention
+        self.attn.add_chunked(self.attn_ln(x), x, self.chunk_frames)
+
+        for start in range(0, x.shape[1], self.chunk_frames):
+            rows = x[:, start : start + self.chunk_frames]
+            rows += self.mlp(self.mlp_ln(rows))
+        return x
+
+class ConversionResidualAttentionBlock(nn.Module):
+    """
+    The graph of a `ResidualAttentionBlock` that convert_encoder.py traces for coremltools, with
+    the per-head attention and the workarounds that only help its compilation; shares the
+    modules, and so the weights and state_dict keys, of `block`
+    """
+    def __init__(self, block: ResidualAttentionBlock):
+        super().__init__()
+        self.attn = block.attn
+        self.attn_ln = block.attn_ln
+        self.mlp = block.mlp
+        self.mlp_ln = block.mlp_ln
+        self.n_state = block.n_state
+
+    def forward(self, x: Tensor):
+        x = speedup_conversion_workaround(x, self.n_state)
+        x = x + self.attn.out(self.attn.looped_attention(self.attn_ln(x)))
         x = speedup_conversion_workaround(x, self.n_state)
         x = x + self.mlp(self.mlp_ln(x))
         return x
@@ -92,11 +226,19 @@ class AudioEncoder(nn.Module):
             self.blocks: Iterable[ResidualAttentionBlock] = nn.ModuleList(
                 [ResidualAttentionBlock(n_state, n_head) for _ in range(n_layer)]
             )
-            self.ln_post = nn.LayerNorm(n_state, eps=1e-7)
+            self.ln_post = LayerNorm(n_state, eps=1e-7)
         self.coremlEncoder = None
+        # (graph, state it was compiled for), set by `load_compiled()`; a tuple rather than the
+        # ScriptModule so that the graph is not registered as a submodule
+        self.compiled = None
+        self.onnx = None
+        self.n_mels = n_mels
+        self.n_ctx = n_ctx
         self.n_state = n_state
         self.n_layer = n_layer
         self.from_block_idx = 0
+        # set by `for_conversion()`
+        self.converting = False
         self.use_coreml = use_coreml
         self.modelName = modelName
 
@@ -111,6 +253,18 @@ class AudioEncoder(nn.Module):
             return self.coreml.encoderPredict(x)
         ############################
 
+        if self.compiled is not None and x.shape == (1, self.n_mels, self.n_ctx * 2):
+            compiled, state = self.compiled
+            if state == self._compiled_state():
+                return compiled(x)
+            warnings.warn(
+                "The encoder changed since it was compiled; running it eagerly. "
+                "Call compile_encoder() again to compile the changed encoder."
+            )
+            self.compiled = None
+        if self.onnx is not None and x.shape == (1, self.n_mels, self.n_ctx * 2):
+            return self.onnx.encoderPredict(x)
+
         self.from_block_idx = 0
         for i in range(0, self.n_layer, 12):
            self.from_block_idx = i
@@ -125,7 +279,14 @@ class AudioEncoder(nn.Module):
             x = F.gelu(self.conv2(x))
             x = x.permute(0, 2, 1)
 
-            x = (x + self.positional_embedding)
+            positional_embedding = self.positional_embedding
+            if not self.converting:
+                # a short last window is encoded over fewer frames, see `short_tail_frames`
+                positional_embedding = positional_embedding[: x.shape[1]]
+            x = (x + positional_embedding)
+        elif self.blocks[self.from_block_idx].chunk_frames is not None:
+            # the low-memory blocks update x in place, which is the caller's tensor here
+            x = x.clone()
 
         for i in range(self.from_block_idx, min(self.from_block_idx + 12, self.n_layer)):
             x = self.blocks[i](x)
@@ -134,3 +295,72 @@ class AudioEncoder(nn.Module):
             x = self.ln_post(x)
 
         return x
+
+    def limit_memory(self, chunk_frames: Optional[int] = 250):
+        """
+        Run the blocks with a bounded peak memory: the attention a block of `chunk_frames` queries
+        at a time, the 4x wider MLP over `chunk_frames` rows at a time, and the residual adds in
+        place, so that no full (n_head, n_ctx, n_ctx) or (n_ctx, 4 * n_state) activation exists.
+        A little slower; None switches back to the default blocks.
+        """
+        if self.use_coreml:
+            raise ValueError("the low-memory mode needs the PyTorch encoder")
+        if chunk_frames is not None and chunk_frames <= 0:
+            raise ValueError("chunk_frames must be positive")
+        for block in self.blocks:
+            block.chunk_frames = chunk_frames
+        return self
+
+    def for_conversion(self):
+        """
+        Switch the blocks to `ConversionResidualAttentionBlock`, the graph convert_encoder.py traces
+        for coremltools; slower in PyTorch, so only the conversion scripts opt in to it
+        """
+        self.blocks = nn.ModuleList(
+            [block if isinstance(block, ConversionResidualAttentionBlock)
+             else ConversionResidualAttentionBlock(block) for block in self.blocks]
+        )
+        self.converting = True
+        return self
+
+    def _compiled_state(self):
+        """
+        What a compiled graph depends on: the weights, which may be changed in place, converted
+        to another dtype or device, or replaced by `fuse_qkv()` and `quantize_int8()`, and the
+        kind and chunking of the blocks
+        """
+        tensors = [*self.parameters(), *self.buffers()]
+        return (
+            tuple((t.data_ptr(), t._version, t.dtype, t.device) for t in tensors),
+            tuple((type(block), getattr(block, "chunk_frames", None)) for block in self.blocks),
+        )
+
+    def load_compiled(self, path: str):
+        """
+        Run single 30-second windows through a frozen TorchScript graph of the encoder, which is
+        loaded from `path`, or traced and saved there first. The graph holds the weights, so
+        `path` has to be specific to the checkpoint, its dtype and the torch version. Once the
+        encoder is changed, by a conversion or by loading other weights, it runs eagerly again.
+        """
+        if self.use_coreml:
+            raise ValueError("the CoreML encoder is compiled by the convert_encoder.py script")
+
+        if os.path.isfile(path):
+            try:
+                compiled = torch.jit.load(path, map_location="cpu")
+                self.compiled = (compiled, self._compiled_state())
+                return
+            except RuntimeError:
+                warnings.warn(f"Failed to load the compiled encoder {path}; compiling it again")
+
+        self.compiled = None
+        x = torch.zeros(1, self.n_mels, self.n_ctx * 2, dtype=self.conv1.weight.dtype)
+        with torch.no_grad():
+            traced = torch.jit.trace(self.eval(), x)
+        compiled = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+        # other workers may be compiling the same encoder; each replaces the file in one step
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torch.jit.save(compiled, f"{path}.{os.getpid()}.tmp")
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        self.compiled = (compiled, self._compiled_state())
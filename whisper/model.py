@@ -1,5 +1,8 @@
 import base64
 import gzip
+import hashlib
+import os
+import warnings
 from dataclasses import dataclass
 from typing import Dict, Iterable, Optional
 
@@ -28,6 +31,22 @@ class ModelDimensions:
     n_text_head: int
     n_text_layer: int
 
+def _state_dict_sha256(module: nn.Module) -> str:
+    """the SHA-256 of the serialized state_dict, streamed rather than held in memory"""
+
+    class Writer:
+        def write(self, data) -> int:
+            sha256.update(data)
+            return len(data)
+
+        def flush(self):
+            pass
+
+    sha256 = hashlib.sha256()
+    torch.save(module.state_dict(), Writer())
+    return sha256.hexdigest()
+
+
 class Whisper(nn.Module):
     def __init__(self, dims: ModelDimensions, use_coreml: bool, modelName):
         super().__init__()
@@ -60,6 +79,8 @@ class Whisper(nn.Module):
         self.n_layer = dims.n_text_layer
         self.n_state = dims.n_text_state
         self.use_coreml = use_coreml
+        # the SHA-256 of the checkpoint file, known for the official models; see `load_model()`
+        self.checkpoint_sha256: Optional[str] = None
 
         bs = 5
         self.text_offset = 0
@@ -117,10 +138,127 @@ class Whisper(nn.Module):
                                                                self.masked_kv_caches)
         return output, cross_qks
 
+    @torch.no_grad()
+    def encode_windows(self, mels: torch.Tensor, batch_size: int = 8) -> torch.Tensor:
+        """
+        Encode many 30-second windows with `batch_size` windows per forward pass of the encoder,
+        which reads the encoder weights once for the whole batch
+
+        Parameters
+        ----------
+        mels: torch.Tensor, shape = (n_windows, n_mels, 3000)
+            The log-Mel spectrograms of the windows, e.g. from `log_mel_spectrogram_batch()`
+
+        batch_size: int
+            The number of windows encoded together
+
+        Returns
+        -------
+        torch.Tensor, shape = (n_windows, n_audio_ctx, n_audio_state)
+            The audio features of the windows
+        """
+        if self.use_coreml:
+            raise ValueError("encode_windows() needs the PyTorch encoder")
+
+        features = [
+            self.encoder(mels[i : i + batch_size].to(self.device))
+            for i in range(0, mels.shape[0], batch_size)
+        ]
+        return torch.cat(features)
+
+    def fuse_qkv(self, fold_layer_norm: bool = True):
+        """
+        Replace the query, key and value projections of every self-attention with one nn.Linear,
+        so that each block runs one GEMM instead of three over the same input, and with
+        `fold_layer_norm` fold the LayerNorm scales and shifts into the projections that follow
+        them. Must be called after the weights are loaded and before `quantize_int8()` or
+        `to_bf16()`, which then apply to the fused layers.
+        """
+        if self.use_coreml:
+            raise ValueError("QKV fusion needs the PyTorch encoder and decoder")
+        if self.decoder.token_projection is not None or self.dtype != torch.float32:
+            raise ValueError("QKV fusion needs the float32 weights")
+
+        for block in [*self.encoder.blocks, *self.decoder.blocks]:
+            block.fuse(fold_layer_norm)
+        return self
+
+    def quantize_int8(self):
+        """
+        Replace the nn.Linear layers of the encoder and decoder, and the projection of the decoder
+        output onto the token embedding, with int8 ones holding per-channel weight scales for
+        faster CPU inference. Must be called after the weights are loaded, since the
+        `fuse_query_and_qk_scale` hook applies to the float weights of the checkpoint.
+        """
+        if self.use_coreml:
+            raise ValueError("int8 quantization needs the PyTorch encoder and decoder")
+        if self.device.type != "cpu":
+            raise ValueError("int8 quantization is only supported on CPU")
+        if self.dtype != torch.float32:
+            raise ValueError("int8 quantization needs the float32 weights")
+
+        # the 51865-row logits projection reuses the embedding; lookups keep the float embedding
+        projection = nn.Linear(self.dims.n_text_state, self.dims.n_vocab, bias=False)
+        projection.weight = self.decoder.token_embedding.weight
+        self.decoder.token_projection = projection
+
+        with warnings.catch_warnings():
+            # eager-mode quantization is deprecated in favour of torchao, not installed by default
+            warnings.simplefilter("ignore")
+            from torch.ao.quantization import per_channel_dynamic_qconfig, quantize_dynamic
+
+            quantize_dynamic(
+                self, {nn.Linear: per_channel_dynamic_qconfig}, dtype=torch.qint8, inplace=True
+            )
+        return self
+
+    def to_bf16(self):
+        """
+        Convert the weights to bfloat16, leaving the LayerNorms in float32, so that the encoder,
+        the decoder and the KV caches run in bfloat16; fast on CPUs with bf16 matrix instructions.
+        Softmax and LayerNorm are computed in float32.
+        """
+        if self.use_coreml:
+            raise ValueError("bfloat16 needs the PyTorch encoder and decoder")
+
+        self.to(torch.bfloat16)
+        for module in self.modules():
+            if isinstance(module, nn.LayerNorm):
+                module.float()
+        return self
+
+    def compile_encoder(self, cache_dir: str):
+        """
+        Encode single windows on the CPU through a frozen TorchScript graph, which is saved in
+        `cache_dir` by model name, weight type, checkpoint fingerprint and torch version and
+        reused by later processes. The fingerprint is the SHA-256 of an official checkpoint, or
+        else of the encoder weights, so that a fine-tuned checkpoint of the same name is not
+        served the graph of another.
+        """
+        if self.device.type != "cpu":
+            raise ValueError("the compiled encoder is only supported on CPU")
+
+        name = os.path.splitext(os.path.basename(self.modelName))[0]
+        weights = "int8" if self.decoder.token_projection is not None else str(self.dtype)[6:]
+        if self.encoder.blocks[0].attn.qkv is not None:
+            weights += "-fused"
+        if self.encoder.blocks[0].chunk_frames is not None:
+            weights += f"-chunk{self.encoder.blocks[0].chunk_frames}"
+        fingerprint = self.checkpoint_sha256 or _state_dict_sha256(self.encoder)
+        path = os.path.join(
+            cache_dir, f"{name}-{weights}-{fingerprint[:16]}-torch{torch.__version__}.pt"
+        )
+        self.encoder.load_compiled(path)
+        return self
+
     @property
     def device(self):
         return next(self.parameters()).device
 
+    @property
+    def dtype(self):
+        return self.decoder.token_embedding.weight.dtype
+
     @property
     def is_multilingual(self):
         return self.dims.n_vocab == 51865
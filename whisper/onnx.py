@@ -0,0 +1,158 @@
+from timeit import default_timer as timer
+from typing import Optional
+
+import numpy as np
+import torch
+from torch import Tensor
+
+logPredictTime = False
+
+totalLoadTime = 0
+totalEncoderTime = 0
+totalDecoder1Time = 0
+totalDecoder256Time = 0
+totalCrossKVTime = 0
+
+
+# runs the pieces exported by convert_onnx.py with ONNX Runtime; the same pieces as the CoreML
+# models, but the caches stay in PyTorch tensors on the Python side and are bound in place
+class Onnx():
+    def __init__(self, n_layer: int, n_state: int, n_head: int, n_vocab: int, modelName,
+                 n_threads: Optional[int] = None):
+        import onnxruntime
+
+        self.ort = onnxruntime
+        self.folder = f'./onnx/{modelName}'
+        self.n_layer = n_layer
+        self.n_state = n_state
+        self.n_head = n_head
+        self.n_vocab = n_vocab
+        self.modelName = modelName
+        self.n_threads = n_threads
+        self.encoders = None
+        self.crossKV = None
+        self.decoder1 = None
+        self.decoder256 = None
+
+    def _session(self, name: str):
+        global totalLoadTime
+        startT = timer()
+        options = self.ort.SessionOptions()
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.n_threads:
+            options.intra_op_num_threads = self.n_threads
+        session = self.ort.InferenceSession(f'{self.folder}/{name}.onnx',
+                                            options,
+                                            providers=['CPUExecutionProvider'])
+        totalLoadTime += timer()-startT
+        return session
+
+    def _run(self, session, **inputs):
+        # ORT reads the inputs in place from the PyTorch tensors through an IO binding, so that
+        # the masked and cross KV caches are not converted or copied on every decoding step
+        binding = session.io_binding()
+        tensors = []
+        for name, value in inputs.items():
+            if value is None:
+                continue
+            tensors.append(value := value.contiguous())  # alive until the run is done
+            binding.bind_input(name, 'cpu', 0, np.float32, list(value.shape), value.data_ptr())
+        for output in session.get_outputs():
+            binding.bind_output(output.name, 'cpu')
+        session.run_with_iobinding(binding)
+        return [torch.from_numpy(output) for output in binding.copy_outputs_to_cpu()]
+
+### Encoder #####################################
+    def loadEncoder(self):
+        if self.encoders is not None:
+            return
+        self.encoders = [self._session(f'Encoder{block_idx}')
+                         for block_idx in range(0, self.n_layer, 12)]
+
+    def encoderPredict(self, melSegment: Tensor):
+        global totalEncoderTime
+        self.loadEncoder()
+        startT = timer()
+
+        x = melSegment
+        for encoder in self.encoders:
+            x = self._run(encoder, x=x)[0]
+
+        if logPredictTime:
+            print(f"\tonnx encoder {timer()-startT:.3f}")
+        totalEncoderTime += timer()-startT
+        return x
+
+### CrossKV #####################################
+    def loadCrossKV(self):
+        if self.crossKV is None:
+            self.crossKV = self._session('CrossKV')
+
+    def crossKVPredict(self, xa: Tensor):
+        global totalCrossKVTime
+        self.loadCrossKV()
+        startT = timer()
+
+        cross_k_caches, cross_v_caches = self._run(self.crossKV, xa=xa)
+
+        if logPredictTime:
+            print(f"\tonnx crossKV {timer()-startT:.3f}")
+        totalCrossKVTime += timer()-startT
+        return cross_k_caches, cross_v_caches
+
+### Decoder256 #####################################
+    def loadDecoder256(self):
+        if self.decoder256 is None:
+            self.decoder256 = self._session('Decoder256')
+
+    def decoder256Predict(self, x, qk_mask, cross_k_caches, cross_v_caches):
+        global totalDecoder256Time
+        self.loadDecoder256()
+        startT = timer()
+
+        outputs = self._run(self.decoder256,
+                            x=x,
+                            qk_mask=qk_mask,
+                            cross_k_caches=cross_k_caches,
+                            cross_v_caches=cross_v_caches)
+
+        if logPredictTime:
+            print(f"\tonnx decoder256 {timer()-startT:.3f}")
+        totalDecoder256Time += timer()-startT
+        return tuple(outputs)
+
+### Decoder1 #####################################
+    def loadDecoder1(self):
+        if self.decoder1 is None:
+            self.decoder1 = self._session('Decoder')
+
+    def decoder1Predict(self, x, qk_mask, masked_kv_caches, cross_k_caches, cross_v_caches):
+        global totalDecoder1Time
+        self.loadDecoder1()
+        startT = timer()
+
+        # exported for any beam size > 1, which has no column for the padding row of bs=1
+        qk_mask = qk_mask[:, :masked_kv_caches.shape[2] + 1]
+        outputs = self._run(self.decoder1,
+                            x=x,
+                            qk_mask=qk_mask,
+                            masked_kv_caches=masked_kv_caches,
+                            cross_k_caches=cross_k_caches,
+                            cross_v_caches=cross_v_caches)
+
+        if logPredictTime:
+            print(f"\tonnx decoder1 {timer()-startT:.3f}")
+        totalDecoder1Time += timer() - startT
+        return tuple(outputs)
+
+########################################
+def showOnnxPredictTime():
+    print("  --- ONNX load model -----")
+    print(f"  total load time    {totalLoadTime:.3f}s")
+    print("  --- ONNX predict --------")
+    print(f"  Encoder            {totalEncoderTime:.3f}s")
+    print(f"  CrossKVCaches      {totalCrossKVTime:.3f}s")
+    print(f"  Decoder256         {totalDecoder256Time:.3f}s")
+    print(f"  Decoder1           {totalDecoder1Time:.3f}s")
+    print(f"  ---")
+    print(f"  total predict time {totalEncoderTime+totalCrossKVTime+totalDecoder1Time+totalDecoder256Time:.3f}s")
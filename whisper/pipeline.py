@@ -0,0 +1,161 @@
+import copy
+from typing import Iterable, Iterator, Optional
+
+import torch
+import torch.multiprocessing
+from torch import Tensor, nn
+
+from .encoder import AudioEncoder
+
+
+def stage_encoder(encoder: AudioEncoder, from_block_idx: int) -> AudioEncoder:
+    """
+    A shallow copy of `encoder` holding only the modules that `block12()` runs from
+    `from_block_idx`, so that a worker receives one stage of the weights rather than all of them
+    """
+    stage = copy.copy(encoder)
+    stage._modules = dict(encoder._modules)
+    stage.blocks = nn.ModuleList(
+        [
+            block if from_block_idx <= i < from_block_idx + 12 else nn.Identity()
+            for i, block in enumerate(encoder.blocks)
+        ]
+    )
+    if from_block_idx != 0:
+        stage.conv1 = stage.conv2 = None
+    if from_block_idx + 12 < encoder.n_layer:
+        stage.ln_post = None
+    stage.from_block_idx = from_block_idx
+    stage.compiled = stage.onnx = None
+    return stage
+
+
+def run_stage(stage: AudioEncoder, n_threads: int, inputs, outputs):
+    """The loop of a worker process: run `stage.block12()` on each input until None arrives"""
+    torch.set_num_threads(n_threads)
+    with torch.no_grad():
+        while (x := inputs.get()) is not None:
+            # an error of an earlier stage is passed on to be raised by `PipelineEncoder.encode()`
+            if isinstance(x, Tensor):
+                try:
+                    x = stage.block12(x)
+                except Exception as e:
+                    x = e
+            outputs.put(x)
+    outputs.put(None)
+
+
+class PipelineEncoder:
+    """
+    Runs the encoder as a pipeline of worker processes, one per 12-block stage of `block12()`,
+    which pass the activations to the next stage over shared-memory queues, so that as many
+    windows as there are stages are encoded at once. The weights are moved to shared memory and
+    each worker maps its own stage only, so the model is not duplicated per worker.
+    Use it as a context manager, or call `close()` to stop the workers.
+
+    Parameters
+    ----------
+    encoder: AudioEncoder
+        The PyTorch encoder on the CPU; its weights are moved to shared memory in place
+
+    threads_per_stage: int
+        The number of torch threads of each worker; by default the threads of this process are
+        divided among the stages
+
+    max_in_flight: int
+        The number of windows in the pipeline at once; by default two per stage, so that each
+        stage has its next input queued when it finishes one
+    """
+
+    def __init__(
+        self,
+        encoder: AudioEncoder,
+        threads_per_stage: Optional[int] = None,
+        max_in_flight: Optional[int] = None,
+    ):
+        if encoder.use_coreml:
+            raise ValueError("the pipelined encoder needs the PyTorch encoder")
+        if encoder.conv1.weight.device.type != "cpu":
+            raise ValueError("the pipelined encoder is only supported on CPU")
+
+        stages = range(0, encoder.n_layer, 12)
+        if threads_per_stage is None:
+            threads_per_stage = max(1, torch.get_num_threads() // len(stages))
+        self.max_in_flight = max_in_flight or 2 * len(stages)
+
+        encoder.eval().share_memory()
+        # spawn rather than fork: the parent has usually loaded torch and started its thread pools
+        context = torch.multiprocessing.get_context("spawn")
+        self.queues = [context.Queue() for _ in range(len(stages) + 1)]
+        self.workers = [
+            context.Process(
+                target=run_stage,
+                args=(
+                    stage_encoder(encoder, from_block_idx),
+                    threads_per_stage,
+                    self.queues[i],
+                    self.queues[i + 1],
+                ),
+                daemon=True,
+            )
+            for i, from_block_idx in enumerate(stages)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.closed = False
+
+    def encode(self, mels: Iterable[Tensor]) -> Iterator[Tensor]:
+        """
+        Stream the log-Mel spectrograms `mels`, each of shape (n_batch, n_mels, 3000), through the
+        stages and yield their audio features in order, each of shape (n_batch, n_audio_ctx,
+        n_audio_state). No more than `max_in_flight` of them are in the pipeline at a time.
+        """
+        if self.closed:
+            raise ValueError("the pipelined encoder is closed")
+
+        n_pending = 0
+        try:
+            for mel in mels:
+                self.queues[0].put(mel)
+                n_pending += 1
+                if n_pending >= self.max_in_flight:
+                    n_pending -= 1
+                    yield self._result()
+
+            while n_pending > 0:
+                n_pending -= 1
+                yield self._result()
+        finally:
+            # leave no output of an abandoned stream to be read by the next one
+            for _ in range(n_pending):
+                self.queues[-1].get()
+
+    def encode_windows(self, mels: Tensor, batch_size: int = 1) -> Tensor:
+        """The same as `Whisper.encode_windows()`, with `batch_size` windows per pipeline input"""
+        batches = (
+            mels[i : i + batch_size] for i in range(0, mels.shape[0], batch_size)
+        )
+        return torch.cat(list(self.encode(batches)))
+
+    def _result(self) -> Tensor:
+        result = self.queues[-1].get()
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queues[0].put(None)
+        # the workers only exit once what they have put in a queue is read
+        while self.queues[-1].get() is not None:
+            pass
+        for worker in self.workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -193,7 +193,7 @@ def find_alignment(
     #    hook.remove()
 
     # heads * tokens * frames
-    weights = cross_head_weights
+    weights = cross_head_weights.float()
     weights = weights[:, :, : num_frames // 2]
     weights = (weights * qk_scale).softmax(dim=-1)
     std, mean = torch.std_mean(weights, dim=-2, keepdim=True, unbiased=False)
@@ -1,7 +1,8 @@
 import argparse
 import os
 import warnings
-from typing import TYPE_CHECKING, Optional, Tuple, Union
+from functools import partial
+from typing import TYPE_CHECKING, BinaryIO, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -13,9 +14,15 @@ from .audio import (
     N_FRAMES,
     N_SAMPLES,
     SAMPLE_RATE,
+    CompactMel,
+    LogMelWindows,
+    MelCache,
+    load_audio,
     log_mel_spectrogram,
     pad_or_trim,
+    resample,
 )
+from .audio_numpy import prefetch_log_mel_spectrograms
 from .decoding import DecodingOptions, DecodingResult
 from .timing import add_word_timestamps
 from .tokenizer import LANGUAGES, TO_LANGUAGE_CODE, get_tokenizer
@@ -28,6 +35,7 @@ from .utils import (
     optional_int,
     str2bool,
 )
+from .vad import plan_windows
 from .coreml import showCoremlPredictTime
 from inspect import currentframe, getframeinfo
 
@@ -36,10 +44,15 @@ if TYPE_CHECKING:
 
 from timeit import default_timer as timer
 
+# encoder passes over the windows, and those saved by reusing the audio features on fallback
+totalEncoderPasses = 0
+totalEncoderPassesSaved = 0
+
 def transcribe(
     model: "Whisper",
-    audio: Union[str, np.ndarray, torch.Tensor],
+    audio: Union[str, bytes, BinaryIO, np.ndarray, torch.Tensor],
     *,
+    sample_rate: int = SAMPLE_RATE,
     verbose: Optional[bool] = None,
     temperature: Union[float, Tuple[float, ...]] = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
     compression_ratio_threshold: Optional[float] = 2.4,
@@ -50,6 +63,12 @@ def transcribe(
     word_timestamps: bool = False,
     prepend_punctuations: str = "\"'“¿([{-",
     append_punctuations: str = "\"'.。,，!！?？:：”)]}、",
+    incremental_mel: Optional[str] = None,
+    mel_cache: Optional[MelCache] = None,
+    vad_filter: bool = False,
+    mel: Optional[Union[np.ndarray, torch.Tensor]] = None,
+    mel_storage: str = "float32",
+    short_tail_frames: Optional[int] = None,
     **decode_options,
 ):
     """
@@ -60,8 +79,13 @@ def transcribe(
     model: Whisper
         The Whisper model instance
 
-    audio: Union[str, np.ndarray, torch.Tensor]
-        The path to the audio file to open, or the audio waveform
+    audio: Union[str, bytes, BinaryIO, np.ndarray, torch.Tensor]
+        The path to the audio file to open, its content as bytes or a binary file-like object,
+        which is decoded in memory through ffmpeg's stdin, or the audio waveform
+
+    sample_rate: int
+        The sample rate of the given audio waveform, which is resampled to 16 kHz in memory
+        if it differs; ignored for audio files
 
     verbose: bool
         Whether to display the text being decoded to the console. If True, displays all the details,
@@ -101,6 +125,39 @@ def transcribe(
         "prompt-engineer" a context for transcription, e.g. custom vocabularies or proper nouns
         to make it more likely to predict those word correctly.
 
+    incremental_mel: Optional[str]
+        If given, compute the log-Mel spectrogram window by window using `LogMelWindows` instead
+        of for the whole audio up front. "global" gives the same spectrogram as the default,
+        "window" normalizes each window on its own and starts transcribing while the audio is
+        still being decoded.
+
+    mel_cache: Optional[MelCache]
+        If given, the log-Mel spectrogram is read from, or computed into, this on-disk cache and
+        the windows are sliced out of the memory-mapped file; takes precedence over `incremental_mel`
+
+    vad_filter: bool
+        Run an energy-based voice activity detection over the log-Mel spectrogram before
+        transcribing, and move the windows past long silences so that they start at speech onsets
+        instead of being encoded and decoded only to be discarded by `no_speech_threshold`
+
+    mel: Optional[Union[np.ndarray, torch.Tensor]]
+        The log-Mel spectrogram of the audio padded with 30 seconds of silence, as given by
+        `log_mel_spectrogram(audio, padding=N_SAMPLES)`, if it was computed beforehand, e.g. in
+        another process; `audio` is not read then and takes precedence over `mel_cache`
+
+    mel_storage: str
+        "float16", "int16" or "uint8" to hold the log-Mel spectrogram in half or a quarter of the
+        memory of "float32" using `CompactMel`, converting it back one window at a time; the
+        quantization error against the float32 spectrogram is printed unless `verbose` is None.
+        Not available with `incremental_mel="window"`.
+
+    short_tail_frames: Optional[int]
+        If given, a last window shorter than 30 seconds is padded only up to the next multiple of
+        this many frames instead of to 3000, and the encoder and cross-attention run over that
+        shorter context. This is much faster on short clips but the model never saw such inputs
+        in training, so check the accuracy on your audio first; e.g. 500 for 5-second buckets.
+        Ignored with the CoreML encoder, whose input shape is fixed.
+
     decode_options: dict
         Keyword arguments to construct `DecodingOptions` instances
 
@@ -108,22 +165,75 @@ def transcribe(
     -------
     A dictionary containing the resulting text ("text") and segment-level details ("segments"), and
     the spoken language ("language"), which is detected when `decode_options["language"]` is None.
+    With `vad_filter`, the amount of skipped silence is reported in "vad".
     """
     startT = timer()
     dtype = torch.float16 if decode_options.get("fp16", True) else torch.float32
-    if model.device == torch.device("cpu"):
+    if model.dtype == torch.bfloat16:
+        # converted by `Whisper.to_bf16()`, e.g. through `load_model(..., bf16=True)`
+        dtype = torch.bfloat16
+    elif model.device == torch.device("cpu"):
         if torch.cuda.is_available():
             warnings.warn("Performing inference on CPU when CUDA is available")
         if dtype == torch.float16:
             warnings.warn("FP16 is not supported on CPU; using FP32 instead")
             dtype = torch.float32
 
-    if dtype == torch.float32:
+    if dtype != torch.float16:
         decode_options["fp16"] = False
 
+    if mel is None and not isinstance(audio, (str, np.ndarray, torch.Tensor)):
+        # the content of a stream can be read only once, so it is decoded up front
+        audio = load_audio(audio)
+    elif not isinstance(audio, str) and sample_rate != SAMPLE_RATE:
+        audio = resample(audio, sample_rate)
+
     # Pad 30-seconds of silence to the input audio, for slicing
-    mel = log_mel_spectrogram(audio, padding=N_SAMPLES)
-    content_frames = mel.shape[-1] - N_FRAMES
+    if mel is not None:
+        mel = torch.as_tensor(mel)
+    elif mel_cache is not None:
+        mel = mel_cache.get(audio, padding=N_SAMPLES)
+    elif incremental_mel is not None:
+        mel = LogMelWindows(audio, padding=N_SAMPLES, normalization=incremental_mel)
+    else:
+        mel = log_mel_spectrogram(audio, padding=N_SAMPLES)
+
+    if short_tail_frames is not None:
+        if short_tail_frames <= 0 or short_tail_frames % 2 != 0:
+            raise ValueError("short_tail_frames must be a positive even number of frames")
+        if model.use_coreml:
+            warnings.warn("short_tail_frames is ignored with the CoreML encoder")
+            short_tail_frames = None
+
+    if mel_storage != "float32":
+        mel = CompactMel(mel, mel_storage)
+        if verbose is not None:
+            print(
+                f"Storing the log-Mel spectrogram as {mel_storage}, "
+                f"max error {mel.max_error:.2e}, RMS error {mel.rms_error:.2e}"
+            )
+
+    if isinstance(mel, LogMelWindows):
+        content_frames = mel.content_frames
+        content_frames_until = mel.content_frames_until
+    else:
+        content_frames = mel.shape[-1] - N_FRAMES
+        # bind the total now; the loop below rebinds `content_frames` on every window
+        content_frames_until = partial(min, content_frames)
+
+    window_plan = None
+    if vad_filter:
+        # the VAD needs the whole spectrogram, so the "window" mode reads the audio through first
+        vad_frames = (
+            mel.n_frames - N_FRAMES if content_frames is None else content_frames
+        )
+        window_plan = plan_windows(mel, vad_frames)
+        if verbose:
+            print(
+                f"Found {len(window_plan.regions)} speech regions in "
+                f"{window_plan.speech_frames / FRAMES_PER_SECOND:.1f}s of "
+                f"{vad_frames / FRAMES_PER_SECOND:.1f}s of audio"
+            )
 
     if decode_options.get("language", None) is None:
         if not model.is_multilingual:
@@ -133,7 +243,8 @@ def transcribe(
                 print(
                     "Detecting language using up to the first 30 seconds. Use `--language` to specify the language"
                 )
-            mel_segment = pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype)
+            mel_segment = pad_or_trim(mel[:, :N_FRAMES], N_FRAMES)
+            mel_segment = mel_segment.to(model.device).to(dtype)
             _, probs = model.detect_language(mel_segment)
             decode_options["language"] = max(probs, key=probs.get)
             if verbose is not None:
@@ -153,6 +264,9 @@ def transcribe(
             [temperature] if isinstance(temperature, (int, float)) else temperature
         )
         decode_result = None
+        # the PyTorch encoder runs once per window; the features of the first attempt are given
+        # to the fallback ones. Core ML keeps its encoder output to itself, so it encodes again.
+        audio_features = None
 
         for t in temperatures:
             kwargs = {**decode_options}
@@ -165,7 +279,10 @@ def transcribe(
                 kwargs.pop("best_of", None)
 
             options = DecodingOptions(**kwargs, temperature=t)
-            decode_result = model.decode(segment, options)
+            decode_result = model.decode(segment, options, audio_features)
+            countEncoderPass(saved=audio_features is not None)
+            if audio_features is None and not model.use_coreml:
+                audio_features = decode_result.audio_features
 
             needs_fallback = False
             if (
@@ -223,16 +340,30 @@ def transcribe(
         }
 
     # show the progress bar when verbose is False (if True, transcribed text will be printed)
+    # the total is unknown when the audio is still being decoded in the "window" mode
     with tqdm.tqdm(
         total=content_frames, unit="frames", disable=verbose is not False
     ) as pbar:
         last_speech_timestamp = 0.0
-        while seek < content_frames:
+        while seek < (content_frames := content_frames_until(seek + N_FRAMES)):
+            if window_plan is not None:
+                next_seek = window_plan.next_seek(seek)
+                if next_seek > seek:
+                    # fast-forward over the silence to the onset of the next speech region
+                    pbar.update(min(window_plan.n_frames, next_seek) - seek)
+                    seek = next_seek
+                    continue
+
             time_offset = float(seek * HOP_LENGTH / SAMPLE_RATE)
             mel_segment = mel[:, seek : seek + N_FRAMES]
             segment_size = min(N_FRAMES, content_frames - seek)
             segment_duration = segment_size * HOP_LENGTH / SAMPLE_RATE
-            mel_segment = pad_or_trim(mel_segment, N_FRAMES).to(model.device).to(dtype)
+            segment_frames = N_FRAMES
+            if short_tail_frames is not None and segment_size < N_FRAMES:
+                # round up to a bucket so that few distinct encoder input shapes occur
+                n_buckets = -(-segment_size // short_tail_frames)
+                segment_frames = min(N_FRAMES, n_buckets * short_tail_frames)
+            mel_segment = pad_or_trim(mel_segment, segment_frames).to(model.device).to(dtype)
 
             decode_options["prompt"] = all_tokens[prompt_reset_since:]
             result: DecodingResult = decode_with_fallback(mel_segment)
@@ -371,15 +502,43 @@ def transcribe(
             # update progress bar
             pbar.update(min(content_frames, seek) - previous_seek)
 
-    return dict(
+    result = dict(
         text=tokenizer.decode(all_tokens[len(initial_prompt_tokens) :]),
         segments=all_segments,
         language=language,
     )
+    if window_plan is not None:
+        result["vad"] = window_plan.summary()
+        if verbose is not None:
+            print(
+                f"VAD skipped {result['vad']['skipped_seconds']:.1f}s of silence "
+                f"in {result['vad']['skipped_regions']} regions"
+            )
+
+    return result
+
+
+def countEncoderPass(saved: bool):
+    global totalEncoderPasses
+    global totalEncoderPassesSaved
+
+    if saved:
+        totalEncoderPassesSaved += 1
+    else:
+        totalEncoderPasses += 1
+
+
+def showEncoderPasses():
+    print("  --- Encoder passes ------")
+    print(f"  encoded windows    {totalEncoderPasses}")
+    print(f"  reused on fallback {totalEncoderPassesSaved}")
+    print("  -------------------------")
 
 
 def cli():
     from . import available_models
+    from .decoder import showCrossKVCaches
+    from .onnx import showOnnxPredictTime
 
     # fmt: off
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -415,8 +574,20 @@ def cli():
     parser.add_argument("--highlight_words", type=str2bool, default=False, help="(requires --word_timestamps True) underline each word as it is spoken in srt and vtt")
     parser.add_argument("--max_line_width", type=optional_int, default=None, help="(requires --word_timestamps True) the maximum number of characters in a line before breaking the line")
     parser.add_argument("--max_line_count", type=optional_int, default=None, help="(requires --word_timestamps True) the maximum number of lines in a segment")
+    parser.add_argument("--incremental_mel", type=str, default=None, choices=["global", "window"], help="compute the log-Mel spectrogram window by window to bound memory on long audio; 'global' gives the same output as the default, 'window' normalizes each window and overlaps decoding with transcription")
+    parser.add_argument("--mel_cache_dir", type=str, default=None, help="directory of an on-disk cache of log-Mel spectrograms, reused when the same audio is transcribed again")
+    parser.add_argument("--vad_filter", type=str2bool, default=False, help="skip long silences found by an energy-based voice activity detection before running the model on them")
+    parser.add_argument("--mel_storage", type=str, default="float32", choices=["float32", "float16", "int16", "uint8"], help="dtype to hold the log-Mel spectrogram in during transcription; the smaller ones save memory on long audio at the cost of a small quantization error")
+    parser.add_argument("--short_tail_frames", type=optional_int, default=None, help="(experimental) pad a last window shorter than 30 seconds only up to a multiple of this many frames, e.g. 500, and encode that shorter context; faster on short clips but may cost accuracy")
+    parser.add_argument("--prefetch", type=int, default=0, help="number of worker processes decoding the audio and computing the log-Mel spectrogram of the next files while the current one is transcribed; 0 to compute them in turn")
     parser.add_argument("--threads", type=optional_int, default=0, help="number of threads used by torch for CPU inference; supercedes MKL_NUM_THREADS/OMP_NUM_THREADS")
     parser.add_argument("--use_coreml", type=str2bool, default=False, help="use coreml backend")
+    parser.add_argument("--backend", type=str, default="pytorch", choices=["pytorch", "coreml", "onnx"], help="backend running the model; onnx needs the models exported by convert_onnx.py")
+    parser.add_argument("--int8", type=str2bool, default=False, help="quantize the weights of the linear layers to int8 for faster CPU inference")
+    parser.add_argument("--bf16", type=str2bool, default=False, help="run the model in bfloat16, with LayerNorm and softmax in float32; fast on CPUs with bf16 matrix instructions")
+    parser.add_argument("--compile_encoder", type=str2bool, default=False, help="run the encoder through a frozen TorchScript graph on the CPU, compiled once and cached next to the downloaded models")
+    parser.add_argument("--low_memory", type=str2bool, default=False, help="run the encoder over chunks of frames with in-place residual adds, which bounds its peak memory at a small cost in speed")
+    parser.add_argument("--fuse_qkv", type=str2bool, default=False, help="run the query, key and value projections of each attention as one GEMM, with the LayerNorm scales and shifts folded into the projections")
     # fmt: on
     args = parser.parse_args().__dict__
     model_name: str = args.pop("model")
@@ -442,11 +613,24 @@ def cli():
     if (threads := args.pop("threads")) > 0:
         torch.set_num_threads(threads)
 
-    use_coreml = args.pop("use_coreml")
+    backend = args.pop("backend")
+    use_coreml = args.pop("use_coreml") or backend == "coreml"
+    int8 = args.pop("int8")
+    bf16 = args.pop("bf16")
+    compile_encoder = args.pop("compile_encoder")
+    fuse_qkv = args.pop("fuse_qkv")
+    low_memory = args.pop("low_memory")
+
+    if (mel_cache_dir := args.pop("mel_cache_dir")) is not None:
+        args["mel_cache"] = MelCache(mel_cache_dir)
+
+    if (prefetch := args.pop("prefetch")) > 0:
+        if args["incremental_mel"] is not None or mel_cache_dir is not None:
+            parser.error("--prefetch cannot be used with --incremental_mel or --mel_cache_dir")
 
     from . import load_model
 
-    model = load_model(model_name, device=device, download_root=model_dir, use_coreml=use_coreml)
+    model = load_model(model_name, device=device, download_root=model_dir, use_coreml=use_coreml, int8=int8, bf16=bf16, compile_encoder=compile_encoder, fuse_qkv=fuse_qkv, low_memory=low_memory, backend=backend)
 
     writer = get_writer(output_format, output_dir)
     word_options = ["highlight_words", "max_line_count", "max_line_width"]
@@ -458,14 +642,25 @@ def cli():
         warnings.warn("--max_line_count has no effect without --max_line_width")
     writer_args = {arg: args.pop(arg) for arg in word_options}
 
-    for audio_path in args.pop("audio"):
+    audio_paths = args.pop("audio")
+    if prefetch > 0:
+        mels = prefetch_log_mel_spectrograms(audio_paths, prefetch, padding=N_SAMPLES)
+    else:
+        mels = ((audio_path, None) for audio_path in audio_paths)
+
+    for audio_path, mel in mels:
         startT = timer()
         frameinfo = getframeinfo(currentframe())
-        result = transcribe(model, audio_path, temperature=temperature, **args)
+        result = transcribe(model, audio_path, temperature=temperature, mel=mel, **args)
         print(f"---------------------------")
         print(f"transcribe() took   {timer() - startT: .3f}s ({frameinfo.filename}:{frameinfo.lineno+1})\n")
+        showEncoderPasses()
+        if not use_coreml:
+            showCrossKVCaches()
         if use_coreml:
             showCoremlPredictTime()
+        if backend == "onnx":
+            showOnnxPredictTime()
         writer(result, audio_path, writer_args)
 
 if __name__ == "__main__":
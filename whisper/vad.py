@@ -0,0 +1,114 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from .audio import FRAMES_PER_SECOND, N_FRAMES
+
+# mel bins 2-60 of the 80-bin filterbank cover roughly 60 Hz - 4 kHz, where most voiced energy is
+SPEECH_BINS = slice(2, 60)
+
+
+def frame_energy(mel, n_frames: int) -> np.ndarray:
+    """
+    Compute the mean log-Mel value of the speech band for each of the first `n_frames` frames,
+    reading `mel` one 30-second window at a time so that `LogMelWindows` and memory-mapped
+    spectrograms are never materialized as a whole.
+    """
+    energies = [np.zeros(0, dtype=np.float32)]
+    for start in range(0, n_frames, N_FRAMES):
+        block = torch.as_tensor(mel[:, start : min(start + N_FRAMES, n_frames)])
+        energies.append(block[SPEECH_BINS].float().mean(dim=0).cpu().numpy())
+    return np.concatenate(energies)
+
+
+def speech_regions(
+    energy: np.ndarray,
+    *,
+    threshold: float = 0.3,
+    min_range: float = 0.25,
+    smoothing_frames: int = 10,
+    pad_frames: int = FRAMES_PER_SECOND // 2,
+    min_silence_frames: int = 2 * FRAMES_PER_SECOND,
+) -> List[Tuple[int, int]]:
+    """
+    Find the frame ranges holding speech from the per-frame energy given by `frame_energy`.
+
+    A frame is speech when its smoothed energy is above `threshold` of the way from the quietest
+    to the loudest frames. The ranges are widened by `pad_frames` on both sides and merged when
+    the silence between them is shorter than `min_silence_frames`, so that only long pauses are
+    ever skipped. When the energy varies by less than `min_range` (one decade of power is 0.25 in
+    the normalized log-Mel scale) there is nothing to tell apart and the whole input is speech.
+    """
+    n_frames = len(energy)
+    if n_frames == 0:
+        return []
+
+    kernel = np.ones(min(smoothing_frames, n_frames)) / min(smoothing_frames, n_frames)
+    smoothed = np.convolve(energy, kernel, mode="same")
+
+    # the loudest frame rather than a percentile, so that a few seconds of speech in an hour of
+    # silence still set the scale; the smoothing keeps isolated clicks from doing the same
+    low, high = np.percentile(smoothed, 5), smoothed.max()
+    if high - low < min_range:
+        return [(0, n_frames)]
+
+    is_speech = smoothed > low + threshold * (high - low)
+
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], is_speech.astype(int), [0]])))
+    regions: List[List[int]] = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        start, end = max(0, start - pad_frames), min(n_frames, end + pad_frames)
+        if regions and start - regions[-1][1] < min_silence_frames:
+            regions[-1][1] = max(regions[-1][1], end)
+        else:
+            regions.append([start, end])
+
+    return [(int(start), int(end)) for start, end in regions]
+
+
+@dataclass
+class WindowPlan:
+    """
+    Plans where `transcribe()` should start its windows: `next_seek` moves a seek position that
+    falls into silence forward to the onset of the next speech region, and keeps count of what
+    was skipped over.
+    """
+
+    regions: List[Tuple[int, int]]
+    n_frames: int
+    skipped_frames: int = 0
+    skipped_regions: int = 0
+    _index: int = field(default=0, repr=False)
+
+    @property
+    def speech_frames(self) -> int:
+        return sum(end - start for start, end in self.regions)
+
+    def next_seek(self, seek: int) -> int:
+        while self._index < len(self.regions) and self.regions[self._index][1] <= seek:
+            self._index += 1
+
+        if self._index < len(self.regions):
+            target = max(seek, self.regions[self._index][0])
+        else:
+            target = max(seek, self.n_frames)
+
+        if target > seek:
+            self.skipped_frames += target - seek
+            self.skipped_regions += 1
+        return target
+
+    def summary(self) -> dict:
+        return dict(
+            speech_frames=self.speech_frames,
+            skipped_frames=self.skipped_frames,
+            skipped_seconds=self.skipped_frames / FRAMES_PER_SECOND,
+            skipped_regions=self.skipped_regions,
+        )
+
+
+def plan_windows(mel, n_frames: int, **kwargs) -> WindowPlan:
+    """Run the energy VAD over the first `n_frames` frames of `mel` and return the window plan"""
+    return WindowPlan(speech_regions(frame_energy(mel, n_frames), **kwargs), n_frames)